@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+    bench/import_time.py
+    ~~~~~~~~~~~~~~~~~~~~
+
+    Measure the cost of importing sphinxcontrib.erlangdomain.
+
+    Each sample runs in a fresh interpreter.  Sphinx and docutils modules
+    which the extension needs anyway are imported before the clock starts,
+    so only the extension's own cost is measured.  Modules newly pulled in
+    by the import, like pkg_resources and distutils, are reported.
+
+    The sources are compiled to bytecode, and a warm-up run is made, before
+    the samples, so that the time of compiling them is not measured.
+
+    Usage::
+
+       python bench/import_time.py [-n SAMPLES] [--baseline REV]
+
+    With ``--baseline``, the tree of a git revision is measured too.
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PRELOAD = [
+    'docutils.nodes',
+    'docutils.parsers.rst',
+    'sphinx.addnodes',
+    'sphinx.builders',
+    'sphinx.directives',
+    'sphinx.domains',
+    'sphinx.locale',
+    'sphinx.roles',
+    'sphinx.transforms',
+    'sphinx.util.docfields',
+    'sphinx.util.nodes',
+]
+
+WATCHED = ['pkg_resources', 'distutils', 'importlib.metadata', 'sphinx.util.logging']
+
+SAMPLE = r'''
+import sys, time
+# the tree comes first, its sphinxcontrib extends the path to others.
+sys.path.insert(0, %(tree)r)
+for name in %(preload)r:
+    __import__(name)
+import sphinxcontrib
+assert sphinxcontrib.__path__[0].startswith(%(tree)r), sphinxcontrib.__path__
+before = set(sys.modules)
+start  = time.perf_counter()
+import sphinxcontrib.erlangdomain
+elapsed = time.perf_counter() - start
+loaded  = [m for m in %(watched)r if m in sys.modules and m not in before]
+print('%%f %%s' %% (elapsed, ','.join(loaded)))
+'''
+
+
+def measure(tree, samples):
+    code = SAMPLE % {'tree': tree, 'preload': PRELOAD, 'watched': WATCHED}
+    subprocess.check_call([sys.executable, '-m', 'compileall', '-q',
+                           os.path.join(tree, 'sphinxcontrib')])
+    # warm-up, e.g. of the file system cache.
+    subprocess.check_output([sys.executable, '-c', code], cwd=tree)
+    times  = []
+    loaded = ''
+    for _ in range(samples):
+        out = subprocess.check_output([sys.executable, '-c', code], cwd=tree)
+        elapsed, _sep, loaded = out.decode('ascii').strip().partition(' ')
+        times.append(float(elapsed))
+    times.sort()
+    return times[len(times) // 2], times[0], loaded
+
+
+def export_tree(rev):
+    tmpdir  = tempfile.mkdtemp(prefix='erlangdomain-')
+    archive = subprocess.Popen(['git', 'archive', rev, 'sphinxcontrib'],
+                               cwd=ROOT, stdout=subprocess.PIPE)
+    subprocess.check_call(['tar', '-x', '-C', tmpdir], stdin=archive.stdout)
+    archive.wait()
+    return tmpdir
+
+
+def report(label, result):
+    median, best, loaded = result
+    print('%-10s median %7.2f ms  best %7.2f ms  newly imported: %s'
+          % (label, median * 1000, best * 1000, loaded or '-'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[2].strip())
+    parser.add_argument('-n', '--samples', type=int, default=20)
+    parser.add_argument('--baseline', metavar='REV',
+                        help='git revision to compare with')
+    args = parser.parse_args()
+
+    report('current', measure(ROOT, args.samples))
+    if args.baseline:
+        tree = export_tree(args.baseline)
+        try:
+            report(args.baseline, measure(tree, args.samples))
+        finally:
+            shutil.rmtree(tree)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+"""
+    bench/signature_parser.py
+    ~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Fuzz and measure the parser of Erlang signatures.
+
+    Valid and invalid signatures are generated from a seed, and parsed by
+    sphinxcontrib/erlangsignature.py of the tree.  With ``--baseline``, they
+    are also parsed by the file of a git revision, and all parsed fields,
+    display and full names, canonical names and argument lists are compared.
+    Signatures parsed per second are reported for each parser.
+
+    Revisions older than erlangsignature.py have the parser in
+    sphinxcontrib/erlangdomain.py, which is loaded instead.
+
+    Usage::
+
+       python bench/signature_parser.py [-n COUNT] [--seed N] [--baseline REV]
+
+    The exit status is 1 if parsers differ.  Sphinx is only needed to load
+    erlangdomain.py of an older revision.
+"""
+
+import argparse
+import importlib.util
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+NAMESPACES = ['cb', 'fn', 'macro', 'rec', 'ty']
+
+FIELDS = ['nsname', 'decltype', 'modname', 'sigil', 'name', 'flavor',
+          'explicit_flavor', 'when_text', 'arity', 'arity_max', 'arg_text',
+          'ret_ann', 'rec_decl', 'arg_list', 'rec_fields']
+
+NAMES = ['to_disp_name', 'to_desc_name', 'to_full_name',
+         'to_full_qualified_name', 'mfa']
+
+
+# {{{ generator.
+ATOMS   = ['lists', 'a', 'x1', 'foo_bar', 'zZ9', 'when', 'fun']
+QUOTED  = ["'lists'", "'Mod'", "'my-mod'", "'a.b'", "'9'", "'_x'", "''",
+           "'a b'", "'it''s'"]
+VARS    = ['Name', '_', '_Acc', 'X1', 'MODULE']
+BAD     = ['1x', 'a-b', '@', 'a:b', '', ' ', '(', '#']
+TYPES   = ['integer()', 'term()', 'lists:list(T)', '[atom()]', '{ok, T} | error',
+           'fun((A) -> B)', '#rec{}', '1..10', '<<_:8>>', '"a, b"', "'[,'"]
+
+def _pick(rnd, *choices):
+    # choices are (weight, list of strings) pairs.
+    total = sum(weight for weight, strings in choices)
+    n = rnd.uniform(0, total)
+    for weight, strings in choices:
+        n -= weight
+        if n <= 0:
+            return rnd.choice(strings)
+    return rnd.choice(choices[-1][1])
+
+def _space(rnd):
+    return rnd.choice(['', '', '', ' ', '  ', '\t'])
+
+def _atom(rnd):
+    return _pick(rnd, (6, ATOMS), (3, QUOTED), (1, BAD))
+
+def _name(rnd):
+    return _pick(rnd, (5, ATOMS), (3, QUOTED), (2, VARS), (1, BAD))
+
+def _arg(rnd, depth):
+    kind = rnd.randrange(8 if depth < 3 else 4)
+    if kind < 2:
+        return rnd.choice(VARS)
+    elif kind < 4:
+        return '%s :: %s' % (rnd.choice(VARS), rnd.choice(TYPES))
+    elif kind < 5:
+        return '{%s}' % (', '.join(_arg(rnd, depth + 1) for _ in range(rnd.randrange(3))),)
+    elif kind < 6:
+        return '[%s | %s]' % (_arg(rnd, depth + 1), _arg(rnd, depth + 1))
+    elif kind < 7:
+        return 'fun(%s)' % (_arg(rnd, depth + 1),)
+    else:
+        return rnd.choice(TYPES)
+
+def _arglist(rnd):
+    args = [_arg(rnd, 0) for _ in range(rnd.randrange(4))]
+    text = ', '.join(args)
+    # optional arguments, may be nested: 'A [, B [, C]]'.
+    opened = 0
+    for _ in range(rnd.randrange(3)):
+        text += '%s[,%s%s' % (_space(rnd), _space(rnd), _arg(rnd, 0))
+        opened += 1
+        if rnd.random() < 0.5:
+            text += ']' * opened
+            opened = 0
+    text += ']' * opened
+    if rnd.random() < 0.1:
+        # unbalanced.
+        text = rnd.choice(['[', ']', '(', ')', '{', '}', '[,']).join(
+            [text[:len(text) // 2], text[len(text) // 2:]])
+    return text
+
+def _body(rnd):
+    kind = rnd.randrange(6)
+    if kind == 0:
+        return ''
+    elif kind == 1:
+        return '/%d' % (rnd.randrange(12),)
+    elif kind == 2:
+        # arity range, invalid if not increasing.
+        low = rnd.randrange(6)
+        return '/%d..%d' % (low, low + rnd.randrange(-1, 4))
+    elif kind == 3:
+        return '{%s}' % (', '.join(
+            '%s%s%s' % (_atom(rnd),
+                        rnd.choice(['', ' = 0', ' = "a, b"']),
+                        rnd.choice(['', ' :: ' + rnd.choice(TYPES)]))
+            for _ in range(rnd.randrange(4))),)
+    else:
+        return '(%s%s%s)' % (_space(rnd), _arglist(rnd), _space(rnd))
+
+def signature(rnd):
+    """
+    A random signature text, valid or not.
+    """
+    parts = []
+    if rnd.random() < 0.6:
+        parts.append(_atom(rnd) + _space(rnd) + ':' + _space(rnd))
+    parts.append(_pick(rnd, (8, ['']), (1, ['#']), (1, ['?'])))
+    parts.append(_name(rnd))
+    body = _body(rnd)
+    parts.append(_space(rnd) + body)
+    if body and not body.startswith('{'):
+        if rnd.random() < 0.3:
+            flavor = _name(rnd)
+            parts.append(rnd.choice(['@%s', ' @ %s', '[@%s]', ' [ @%s ] ']) % (flavor,))
+        if rnd.random() < 0.2:
+            parts.append(' when %s' % (rnd.choice(TYPES),))
+        if rnd.random() < 0.4:
+            parts.append(' -> %s' % (rnd.choice(TYPES + ['', ' '])))
+    if rnd.random() < 0.1:
+        parts.append('.')
+    text = ''.join(parts)
+    if rnd.random() < 0.05 and text:
+        # mutate a character.
+        i = rnd.randrange(len(text))
+        text = text[:i] + rnd.choice('()[]{},.:@/#?\' ') + text[i + 1:]
+    return text
+
+def corpus(count, seed):
+    rnd = random.Random(seed)
+    return [(signature(rnd), rnd.choice(NAMESPACES)) for _ in range(count)]
+# }}} generator.
+
+
+# {{{ differential check.
+def load(filename, name):
+    spec = importlib.util.spec_from_file_location(name, filename)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def _call(func, *args):
+    try:
+        return ('ok', func(*args))
+    except Exception as e:
+        return ('error', type(e).__name__)
+
+def common_attributes(reference, candidate):
+    """
+    FIELDS and NAMES which both parsers have, and those missing on a side,
+    e.g. rec_fields before record fields were parsed.
+    """
+    common  = []
+    missing = []
+    for attr in FIELDS + NAMES:
+        sides = [hasattr(module.ErlangSignature.from_text('m:f(A) -> ok', 'fn'), attr)
+                 for module in (reference, candidate)]
+        if all(sides):
+            common.append(attr)
+        else:
+            missing.append((attr, 'baseline' if not sides[0] else 'current'))
+    return common, missing
+
+def describe(module, text, nsname, attrs=FIELDS + NAMES):
+    """
+    Everything the parser of `module` tells about a signature, as a dict
+    comparable between modules.  Only `attrs` of parsed signatures are
+    described.
+    """
+    cls = module.ErlangSignature
+    result = {}
+    parsed = _call(cls.from_text, text, nsname)
+    if parsed[0] == 'ok':
+        sig = parsed[1]
+        result['from_text'] = ('ok',)
+        for attr in attrs:
+            if attr in NAMES:
+                result[attr + '()'] = _call(getattr(sig, attr))
+            else:
+                result[attr] = getattr(sig, attr)
+    else:
+        result['from_text'] = parsed
+    for token in text.replace('(', ' ').replace(':', ' ').split()[:3]:
+        result['canon_atom(%r)' % (token,)] = _call(cls.canon_atom, token)
+        result['canon_name(%r)' % (token,)] = _call(cls.canon_name, token)
+    if '(' in text:
+        arg_text = text[text.index('(') + 1:text.rfind(')')]
+        result['_split_arglist(%r)' % (arg_text,)] = \
+            _call(lambda s: list(cls._split_arglist(s)), arg_text)
+    return result
+
+def differ(reference, candidate, signatures, attrs):
+    for text, nsname in signatures:
+        expected = describe(reference, text, nsname, attrs)
+        actual   = describe(candidate, text, nsname, attrs)
+        if expected != actual:
+            yield text, nsname, expected, actual
+# }}} differential check.
+
+
+# {{{ throughput.
+def throughput(module, signatures, repeat):
+    # :: signatures per second, the best of `repeat` runs.
+    from_text = module.ErlangSignature.from_text
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for text, nsname in signatures:
+            try:
+                from_text(text, nsname)
+            except Exception:
+                pass
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return len(signatures) / best
+
+def report(label, module, signatures, repeat):
+    print('%-10s %10.0f signatures/s' % (label, throughput(module, signatures, repeat)))
+# }}} throughput.
+
+
+def export_file(rev, paths):
+    # the first of paths which exists in rev.
+    for path in paths:
+        try:
+            data = subprocess.check_output(['git', 'show', '%s:%s' % (rev, path)],
+                                           cwd=ROOT, stderr=subprocess.PIPE)
+            break
+        except subprocess.CalledProcessError:
+            continue
+    else:
+        sys.exit('%s has none of %s' % (rev, ', '.join(paths)))
+    fd, filename = tempfile.mkstemp(prefix='erlangsignature-', suffix='.py')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    return filename
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[2].strip())
+    parser.add_argument('-n', '--count', type=int, default=20000,
+                        help='number of signatures')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='runs of the throughput measurement')
+    parser.add_argument('--baseline', metavar='REV',
+                        help='git revision to compare with')
+    parser.add_argument('--max-diffs', type=int, default=10,
+                        help='differences to show')
+    args = parser.parse_args()
+
+    candidate  = load(os.path.join(ROOT, 'sphinxcontrib/erlangsignature.py'),
+                      'erlangsignature_current')
+    signatures = corpus(args.count, args.seed)
+    valid = sum(1 for (text, nsname) in signatures
+                if describe(candidate, text, nsname)['from_text'][0] == 'ok')
+    print('%d signatures, %d valid, seed %d' % (len(signatures), valid, args.seed))
+
+    report('current', candidate, signatures, args.repeat)
+    if not args.baseline:
+        return 0
+
+    filename = export_file(args.baseline, ['sphinxcontrib/erlangsignature.py',
+                                           'sphinxcontrib/erlangdomain.py'])
+    try:
+        reference = load(filename, 'erlangsignature_baseline')
+    except ImportError as e:
+        sys.exit('cannot load the parser of %s: %s' % (args.baseline, e))
+    finally:
+        os.unlink(filename)
+    report(args.baseline, reference, signatures, args.repeat)
+
+    attrs, missing = common_attributes(reference, candidate)
+    for attr, side in missing:
+        print('not compared: %s, missing in %s' % (attr, side))
+
+    diffs = 0
+    for text, nsname, expected, actual in differ(reference, candidate, signatures, attrs):
+        if diffs < args.max_diffs:
+            print('\n%r as %s' % (text, nsname))
+            for key in sorted(set(expected) | set(actual)):
+                if expected.get(key) != actual.get(key):
+                    print('  %s' % (key,))
+                    print('    %-10s %r' % (args.baseline, expected.get(key)))
+                    print('    %-10s %r' % ('current', actual.get(key)))
+        diffs += 1
+    print('%d differences' % (diffs,))
+    return 1 if diffs else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
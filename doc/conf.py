@@ -214,3 +214,9 @@ man_pages = [
      u'sphinxcontrib-erlangdomain Documentation',
      [u'SHIBUKAWA Yoshiki'], 1)
 ]
+
+
+def setup(app):
+    app.add_object_type('confval', 'confval',
+                        objname='configuration value',
+                        indextemplate='pair: %s; configuration value')
@@ -41,4 +41,9 @@ setup(
     include_package_data=True,
     install_requires=requires,
     namespace_packages=['sphinxcontrib'],
+    entry_points={
+        'console_scripts': [
+            'sphinx-erlang = sphinxcontrib.erlangtool:main',
+        ],
+    },
 )
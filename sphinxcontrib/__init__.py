@@ -10,5 +10,6 @@
     :license: BSD, see LICENSE for details.
 """
 
-__import__('pkg_resources').declare_namespace(__name__)
+# pkgutil-style namespace, importing pkg_resources is slow.
+__path__ = __import__('pkgutil').extend_path(__path__, __name__)
 
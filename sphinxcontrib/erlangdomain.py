@@ -9,16 +9,22 @@
     :license: BSD, see LICENSE for details.
 """
 
+import bisect
 import copy
-from distutils.version import LooseVersion, StrictVersion
-from pkg_resources import get_distribution
+import hashlib
+import io
+import json
+import os
 import re
 import string
+import struct
 import sys
+import time
 
 from docutils import nodes
 from docutils.parsers.rst import directives
 
+import sphinx
 from sphinx import addnodes
 from sphinx.roles import XRefRole
 from sphinx.locale import l_, _
@@ -26,9 +32,13 @@ from sphinx.directives import ObjectDescription
 from sphinx.domains import Domain, ObjType, Index
 #from sphinx.util.compat import Directive
 from docutils.parsers.rst import Directive
+from docutils.transforms import Transform
 from sphinx.util.nodes import make_refnode
+from sphinx.util.matching import compile_matchers
 from sphinx.util.docfields import Field, GroupedField, TypedField
 
+from sphinxcontrib.erlangsignature import ErlangSignature
+
 # +===+====================+=======+=============+==========+=================+
 # | # | directive          | ns(*1)| object_type | decltype | role            |
 # +===+====================+=======+=============+==========+=================+
@@ -53,70 +63,58 @@ from sphinx.util.docfields import Field, GroupedField, TypedField
 #      which its ancestor node is.
 
 
-RE_ATOM = re.compile( r'''
+RE_FULLNAME = re.compile( r'''
     ^
-    (?: ([a-z]\w*) | '([-\w.]+)' )
+    # modname.
+    (?P<modname> [a-z]\w*|'[-\w.]+')
+    :
+    (?P<name> [a-zA-Z_]\w*|'[-\w.]+')
+    (?:
+        [/]
+        (?P<arity>\d+)
+        (?:[.][.](?P<arity_max>\d+))?
+    )?
     \Z
     ''', re.VERBOSE)
 
-
-RE_NAME = re.compile( r'''
+RE_FIELD_TARGET = re.compile(r'''
     ^
-    (?: ([A-Za-z_]\w*) | '([-\w.]+)' )
+    (?: (?P<modname> [a-z]\w*|'[-\w.]+') \s* : \s* )?
+    [#]? (?P<name> [a-z]\w*|'[-\w.]+') \s*
+    (?: [{] \s* [}] \s* )?
+    [.] \s*
+    (?P<field> [a-z]\w*|'[-\w.]+')
+    \s*
     \Z
     ''', re.VERBOSE)
 
-
-RE_SIGNATURE = re.compile( r'''
+RE_PATTERN_TARGET = re.compile(r'''
     ^
-    # modname.
-    (?:
-        (?P<modname> [a-z]\w*|'[-\w.]+')
-        \s*
-        :
-        \s*
-    )?
-
-    # sigil and thing name.
-    (?P<sigil>[#?])?
-    (?P<name> [a-zA-Z_]\w*|'[-\w.]+')
+    (?: (?P<modname> [a-z]\w*|'[-\w.]+') \s* : \s* )?
+    (?P<prefix> [a-z]\w*|'[-\w.]+|) (?P<star> [*])?
+    (?: \s* / \s* (?P<arity> \d+|[*]) )?
     \s*
+    \Z
+    ''', re.VERBOSE)
 
-    (?:
-        (?:
-            [/] \s* (?P<arity>\d+) (?:[.][.](?P<arity_max>\d+))? \s*
-        |
-            [(] \s* (?P<arg_text>.*?) \s* [)] \s*
-        )
-        (?:
-            [@] \s* (?P<flavor> [a-zA-Z_]\w*|'[-\w.]+') \s*
-        |
-            \[ \s* [@] \s* (?P<implicit_flavor> [a-zA-Z_]\w*|'[-\w.]+') \s* \] \s*
-        )?
-        (?: when \s* (?P<when_text> .+?) \s* )?
-        (?: -> \s* (?P<ret_ann>\S.*?) \s* )?
-    |
-        [{] \s* (?P<rec_decl>\S.*?)? \s* [}] \s*
-    )?
+RE_TYPE_CALL = re.compile(r'''
+    (?<![\w'?#])
+    (?: (?P<modname> [a-z]\w*|'[-\w.]+') \s* : \s* )?
+    (?P<name> [a-z]\w*|'[-\w.]+')
+    \s*
+    (?=[(])
+    ''', re.VERBOSE)
 
-    # drop a terminal period at this time if any.
-    [.]?
+RE_MODULE_DIRECTIVE = re.compile(r'''
+    ^
+    \.\. \s+ erl:module:: \s+ (?P<modname> [a-z]\w*|'[-\w.]+') \s*
     \Z
     ''', re.VERBOSE)
 
-RE_PUNCS = re.compile(r'(\[,|[\[\]{}(),])')
-
-RE_FULLNAME = re.compile( r'''
+RE_SECTION_ADORNMENT = re.compile(r'''
     ^
-    # modname.
-    (?P<modname> [a-z]\w*|'[-\w.]+')
-    :
-    (?P<name> [a-zA-Z_]\w*|'[-\w.]+')
-    (?:
-        [/]
-        (?P<arity>\d+)
-        (?:[.][.](?P<arity_max>\d+))?
-    )?
+    ([!-/:-@[-`{-~])\1+
+    \s*
     \Z
     ''', re.VERBOSE)
 
@@ -138,293 +136,356 @@ else:
         return d.items()
 
 
-_SPHINX_VERSION = LooseVersion(get_distribution('Sphinx').version)
+def _version_tuple(version):
+    # '1.8.6' -> (1, 8, 6), '2.0.0b1' -> (2, 0, 0)
+    return tuple(int(n) for n in re.match(r'\d+(?:[.]\d+)*', version).group(0).split('.'))
 
-if _SPHINX_VERSION < LooseVersion('1.3'):
+# sphinx.version_info is since sphinx 1.2.
+_SPHINX_VERSION = tuple(getattr(sphinx, 'version_info', None)
+                        or _version_tuple(sphinx.__version__))[:3]
+
+if _SPHINX_VERSION < (1, 3):
     def _ref_context(env):
         return env.temp_data
 else:
     def _ref_context(env):
         return env.ref_context
 
-if _SPHINX_VERSION < LooseVersion('1.4'):
+if _SPHINX_VERSION < (1, 4):
     def _indexentry(entrytype, entryname, target, ignored, key):
         return (entrytype, entryname, target, ignored)
 else:
     def _indexentry(entrytype, entryname, target, ignored, key):
         return (entrytype, entryname, target, ignored, key)
 
-if _SPHINX_VERSION < LooseVersion('1.6'):
+_logger = None
+if _SPHINX_VERSION < (1, 6):
     def _warn(env, fmt, *args, **kwargs):
         msg = fmt % args
         (docname, lineno) = kwargs['location']
         env.warn(docname, msg, lineno)
 else:
-    from sphinx.util import logging
-    logger = logging.getLogger(__name__)
     def _warn(env, fmt, *args, **kwargs):
-        logger.warn(fmt, *args, **kwargs)
+        # imported on the first warning.
+        global _logger
+        if _logger is None:
+            from sphinx.util import logging
+            _logger = logging.getLogger(__name__)
+        _logger.warning(fmt, *args, **kwargs)
+
+if _SPHINX_VERSION < (1, 6):
+    def _info(app, fmt, *args):
+        app.info(fmt % args)
+else:
+    def _info(app, fmt, *args):
+        global _logger
+        if _logger is None:
+            from sphinx.util import logging
+            _logger = logging.getLogger(__name__)
+        _logger.info(fmt, *args)
+
+if _SPHINX_VERSION < (1, 8):
+    def _add_js_file(app, filename):
+        app.add_javascript(filename)
+else:
+    def _add_js_file(app, filename):
+        app.add_js_file(filename)
 # }}} compat.
 
 
-class ErlangObjectContext:
-    def __init__(self, objtype, sigdata):
-        self.objtype = objtype
-        self.sigdata = sigdata
-
-class ErlangSignature:
-    @classmethod
-    def canon_atom(cls, name):
-        return cls.canon_name_(name, RE_ATOM)
-
-    @classmethod
-    def canon_name(cls, name):
-        return cls.canon_name_(name, RE_NAME)
-
-    @staticmethod
-    def canon_name_(name, regexp):
-        m = regexp.match(name)
-        if not m:
-            # invalid.
-            raise ValueError
-        if m.group(1) is not None:
-            # valid short form.
-            return name
-        m = RE_ATOM.match(m.group(2))
-        if m and m.group(1):
-            # can be described in short form.
-            return m.group(1)
-        # valid long form.
-        return name
-
-    def __init__(self, nsname, d):
-        self.nsname    = nsname
-        self.decltype  = None
-        self.modname   = d['modname'  ]  # Optional[str]
-        self.sigil     = d['sigil'    ]  # Optional[str]
-        self.name      = d['name'     ]  # str
-        self.flavor    = d['flavor'   ]  # Optional[str]
-        self.when_text = d['when_text']  # Optional[str]
-        self.arity     = d['arity'    ]  # Optional[int]
-        self.arity_max = d['arity_max']  # Optional[int]
-        self.arg_text  = d['arg_text' ]  # Optional[str]
-        self.ret_ann   = d['ret_ann'  ]  # Optional[str]
-        self.rec_decl  = d['rec_decl' ]  # Optional[str]
-        self.arg_list  = None
-        self.explicit_flavor = None
-
-        if self.modname is not None:
-            self.modname = self.canon_atom(self.modname)
-        if nsname == 'macro':
-            self.name = self.canon_name(self.name)
-        else:
-            self.name = self.canon_atom(self.name)
-
-        self.explicit_flavor = self.flavor is not None
-        if self.flavor is None and d['implicit_flavor'] is not None:
-            self.flavor = d['implicit_flavor']
-        if self.flavor is not None:
-            self.flavor = self.canon_atom(self.flavor)
+# {{{ diagnostics.
+def _diagnose(env, code, fmt, *args, **kwargs):
+    """
+    Record a problem in a document, and warn about it.
 
-        # check constraint on sigil.
-        if self.sigil:
-            if (nsname, self.sigil) not in (('macro', '?'), ('rec', '#')):
-                raise ValueError
+    code is the kind of the problem, e.g. 'duplicate-object', which is
+    also the subtype of the warning for suppress_warnings, 'erl.<code>'.
+    key is the object or the module of the problem.  Repeats of the same
+    diagnostic are dropped, and at most erl_warning_limit warnings of
+    each code are shown.
 
-        # check constraint on arity.
-        if self.arity_max is not None:
-            if self.arity is not None and self.arity >= self.arity_max:
-                raise ValueError
-
-        # check constraint on the body part by nsname.
-        if self.arity is not None:
-            arg_type = 'arity'
-        elif self.arg_text is not None:
-            arg_type = 'arglist'
-        elif self.rec_decl is not None:
-            arg_type = 'record'
-        else:
-            arg_type = 'none'
-
-        ACCEPTABLE_ARG_TYPES = {
-            'cb'   : ['arity', 'arglist', 'none'],
-            'fn'   : ['arity', 'arglist', 'none'],
-            'macro': ['arity', 'arglist', 'none'],
-            'rec'  : ['record', 'none'],
-            'ty'   : ['arity', 'arglist', 'none'],
-        }
-        if arg_type not in ACCEPTABLE_ARG_TYPES[nsname]:
-            if arg_type != 'none':
-                raise ValueError
+    Diagnostics of documents being read are warned after all of them are
+    read and merged, see _warn_diagnostics, so that the limit also holds
+    for parallel reads.
+    """
+    (docname, lineno) = kwargs['location']
+    record = {
+        'code'   : code,
+        'docname': docname,
+        'lineno' : lineno,
+        'key'    : kwargs.get('key'),
+        'message': fmt % args,
+    }
+    domain = env.get_domain('erl')
+    if not domain.add_diagnostic(record):
+        return
+    if getattr(domain, '_deferred_docnames', None) is None:
+        _warn_diagnostic(env, domain, record)
+
+def _warn_diagnostic(env, domain, record):
+    code   = record['code']
+    counts = domain._diagnostic_counts()
+    counts[code] = counts.get(code, 0) + 1
+    limit = _warning_limit(env.config)
+    if limit is not None and counts[code] > limit:
+        return
+    _warn(env, '%s', record['message'], location=(record['docname'], record['lineno']),
+          type='erl', subtype=code)
+
+def _defer_diagnostics(app, env, docnames):
+    # the list of documents to be read, see _diagnose.
+    env.get_domain('erl')._deferred_docnames = docnames
+
+def _warn_diagnostics(app, env):
+    # warn diagnostics of the documents read, in the order of documents.
+    domain   = env.get_domain('erl')
+    docnames = getattr(domain, '_deferred_docnames', None)
+    domain._deferred_docnames = None
+    for docname in sorted(set(docnames or [])):
+        for record in sorted(domain.data['diagnostics'].get(docname, []),
+                             key=_diagnostic_key):
+            _warn_diagnostic(env, domain, record)
+
+def _warning_limit(config):
+    # may be a string by 'sphinx-build -D'.
+    if config.erl_warning_limit is None:
+        return None
+    return int(config.erl_warning_limit)
+
+def _diagnostic_key(record):
+    return (record['docname'], record['lineno'] or 0, record['code'],
+            record['message'])
+
+def _diagnostic_id(record):
+    # a diagnostic of a document, for repeats.
+    return (record['code'], record['lineno'], record['key'], record['message'])
+
+def _write_diagnostics(app, exception):
+    if exception is not None:
+        return
+    domain  = app.env.get_domain('erl')
+    records = []
+    for docname in sorted(domain.data['diagnostics']):
+        records.extend(sorted(domain.data['diagnostics'][docname],
+                              key=_diagnostic_key))
+
+    if app.config.erl_diagnostics_file:
+        _write_if_changed(
+            os.path.join(app.builder.outdir, app.config.erl_diagnostics_file),
+            ''.join(_to_json(record) + '\n' for record in records))
+
+    if records:
+        _info_diagnostics(app, domain, records)
+    # for the next build in this process.
+    domain._diagnostic_counts_cache = None
+
+def _info_diagnostics(app, domain, records):
+    totals = {}
+    for record in records:
+        totals[record['code']] = totals.get(record['code'], 0) + 1
+    _info(app, 'Erlang domain: %d diagnostics (%s).', len(records),
+          ', '.join('%s: %d' % item for item in sorted(_iteritems(totals))))
+
+    limit  = _warning_limit(app.config)
+    hidden = sum(max(0, n - limit) for n in domain._diagnostic_counts().values()) \
+             if limit is not None else 0
+    if hidden:
+        _info(app, 'Erlang domain: %d warnings are not shown by erl_warning_limit.',
+              hidden)
+# }}} diagnostics.
+
+
+def _arity_key(arity):
+    # arity may be None for records and macros.
+    if arity is None:
+        return -1
+    return arity
+
+def _flavor_key(flavor):
+    if flavor is None:
+        return ''
+    return flavor
+
+
+# predefined and built-in types, never looked up.
+BUILTIN_TYPES = frozenset([
+    'any', 'arity', 'atom', 'binary', 'bitstring', 'boolean', 'byte', 'char',
+    'dynamic', 'float', 'fun', 'function', 'identifier', 'integer', 'iodata',
+    'iolist', 'list', 'map', 'maybe_improper_list', 'mfa', 'module',
+    'neg_integer', 'nil', 'no_return', 'node', 'non_neg_integer',
+    'nonempty_binary', 'nonempty_bitstring', 'nonempty_improper_list',
+    'nonempty_list', 'nonempty_maybe_improper_list', 'nonempty_string',
+    'none', 'number', 'pid', 'port', 'pos_integer', 'record', 'reference',
+    'string', 'term', 'timeout', 'tuple',
+])
+
+
+class erl_typeref(nodes.Inline, nodes.TextElement):
+    """
+    Reference to a type in a signature.
 
-        # compute arity.
-        if self.arg_text is not None:
-            self.arg_list  = list(self._split_arglist(self.arg_text))
-            self.arity     = len(list(filter(lambda arg: arg[0] == 'mandatory', self.arg_list)))
-            if self.arity == len(self.arg_list):
-                self.arity_max = None
-            else:
-                self.arity_max = len(self.arg_list)
+    Resolved in a batch per document by resolve_type_references.
+    """
 
-        if self.when_text is not None:
-            if self.nsname not in ('cb', 'fn', 'macro', 'ty'):
-                raise ValueError
 
-        if self.ret_ann is not None:
-            if self.nsname not in ('cb', 'fn', 'macro'):
-                raise ValueError
+def _count_args(text, start):
+    # text[start] is '('.  returns (arity, index of ')') or None.
+    depth = 0
+    arity = 0
+    blank = True
+    for i in range(start, len(text)):
+        c = text[i]
+        if c in '([{':
+            depth += 1
+            if depth == 1:
+                continue
+        elif c in ')]}':
+            depth -= 1
+            if depth == 0:
+                return (0 if blank else arity + 1), i
+        elif c == ',' and depth == 1:
+            arity += 1
+        if depth >= 1 and not c.isspace():
+            blank = False
+    return None
+
+def type_reference_nodes(text, modname):
+    """
+    Split a type expression into text nodes and erl_typeref nodes.
 
-    @staticmethod
-    def _split_arglist(arglist_str):
-        tmp   = ''
-        stack = []
-        opt   = False
-        for token in RE_PUNCS.split(arglist_str):
-            if not token or token.isspace():
-                pass
-            elif token in ('[', '{', '('):
-                tmp += token
-                stack.append(token)
-            elif token in (']', '}', ')'):
-                if not stack:
-                    raise ValueError
-                if stack.pop() == '[,':
-                    if tmp:
-                        yield ('optional', tmp.strip())
-                        tmp = ''
-                else:
-                    tmp += token
-            elif token == ',' and not stack:
-                yield ('mandatory', tmp.strip())
-                tmp = ''
-            elif token == '[,':
-                if opt:
-                    yield ('optional', tmp.strip())
-                else:
-                    yield ('mandatory', tmp.strip())
-                tmp = ''
-                opt = True
-                stack.append(token)
+    `modname` is the module for unqualified type names.
+    """
+    pos = 0
+    for m in RE_TYPE_CALL.finditer(text):
+        counted = _count_args(text, m.end())
+        if counted is None:
+            continue
+        try:
+            name = ErlangSignature.canon_atom(m.group('name'))
+            if m.group('modname') is None:
+                if name in BUILTIN_TYPES:
+                    continue
+                refmod = modname
             else:
-                tmp += token
-
-        if stack:
-            raise ValueError
-
-        tmp = tmp.strip()
-        if tmp:
-            yield ('mandatory', tmp)
-
-
-    @classmethod
-    def from_text(cls, sig_text, nsname): # (str, nsname) -> ErlangSignature
-        m = RE_SIGNATURE.match(sig_text)
-        if not m:
-            raise ValueError
-
-        d = m.groupdict()
-        if d['arity'] is not None:
-            d['arity'] = int(d['arity'])
-        if d['arity_max'] is not None:
-            d['arity_max'] = int(d['arity_max'])
-
-        return cls(nsname, d)
-
-
-    def to_disp_name(self):
-        if self.modname is None:
-            modname = ''
+                refmod = ErlangSignature.canon_atom(m.group('modname'))
+        except ValueError:
+            continue
+
+        if m.start() > pos:
+            yield nodes.Text(text[pos:m.start()])
+        name_text = m.group(0).rstrip()
+        yield erl_typeref(name_text, name_text,
+                          **{'erl:module': refmod, 'erl:name': name, 'erl:arity': counted[0]})
+        pos = m.start() + len(name_text)
+
+    if pos < len(text):
+        yield nodes.Text(text[pos:])
+
+def resolve_type_references(app, doctree, docname):
+    refs = list(doctree.traverse(erl_typeref))
+    if not refs:
+        return
+
+    domain = app.env.get_domain('erl')
+    index  = domain._type_index()
+    for node in refs:
+        key   = (node['erl:module'], node['erl:name'], node['erl:arity'])
+        found = index.get(key)
+        if found is None:
+            node.replace_self(node.children)
         else:
-            modname = '%s:' % (self.modname,)
+            todocname, refname, title = found
+            contnode = nodes.inline(node.astext(), '', *node.children)
+            node.replace_self(make_refnode(app.builder, docname, todocname,
+                                           refname, contnode, title))
 
-        name = self.local_disp_name_()
 
-        flavor = ''
-        if self.flavor is not None:
-            flavor = '@%s' % (self.flavor,)
+class erl_backlinks(nodes.General, nodes.Element):
+    """
+    Placeholder of "referenced by" links of an object.
 
-        if self.ret_ann is not None:
-            retann = ' -> %s' % (self.ret_ann,)
-        else:
-            retann = ''
+    Filled from ErlangDomain.data['backlinks'] by render_backlinks.
+    """
 
-        return modname + name + flavor + retann
 
-    def local_disp_name_(self):
-        if self.nsname == 'rec':
-            if self.rec_decl is None:
-                return '#%s{}' % (self.name,)
-            else:
-                return '#%s{ %s }' % (self.name, self.rec_decl)
-        else:
-            if self.nsname == 'macro':
-                sigil = '?'
-            else:
-                sigil = ''
-            if self.arity is None:
-                return '%s%s'        % (sigil, self.name)
-            elif self.arg_text is not None:
-                return '%s%s(%s)'    % (sigil, self.name, self.arg_text)
-            elif self.arity_max is None:
-                return '%s%s/%d'     % (sigil, self.name, self.arity)
-            else:
-                return '%s%s/%d..%d' % (sigil, self.name, self.arity, self.arity_max)
+class erl_objectlist(nodes.General, nodes.Element):
+    """
+    Placeholder of a list of objects matching a pattern.
 
+    Filled by render_object_lists.
+    """
 
-    def to_desc_name(self):
-        if self.nsname == 'rec':
-            return '#%s{}' % (self.name,)
-        else:
-            if self.nsname == 'macro':
-                sigil = '?'
-            else:
-                sigil = ''
-            if self.arity is None:
-                return '%s%s'        % (sigil, self.name)
-            elif self.arg_text is not None:
-                return '%s%s'        % (sigil, self.name)
-            elif self.arity_max is None:
-                return '%s%s/%d'     % (sigil, self.name, self.arity)
-            else:
-                return '%s%s/%d..%d' % (sigil, self.name, self.arity, self.arity_max)
 
-    def is_arglist_mandatory(self):
-        return self.nsname in ['cb', 'fn', 'ty']
+def _object_index_text(decltype, name):
+    if decltype == 'callback':
+        return _('%s (Erlang callback function)') % name
+    elif decltype == 'function':
+        return _('%s (Erlang function)') % name
+    elif decltype == 'macro':
+        return _('%s (Erlang macro)') % name
+    elif decltype == 'opaque':
+        return _('%s (Erlang opaque type)') % name
+    elif decltype == 'record':
+        return _('%s (Erlang record)') % name
+    elif decltype == 'type':
+        return _('%s (Erlang type)') % name
+    else:
+        raise ValueError
+
+def _object_index_entries(env, sigdata, refname, fullname):
+    # :: [index entry] of an object in the current document.
+    if not env.config.erl_index_grouped:
+        indextext = _object_index_text(sigdata.decltype, fullname)
+        return [_indexentry('single', indextext, refname, fullname, None)]
+
+    # one subentry under the module for all arities, flavors and
+    # clauses of a name in a document.
+    if sigdata.nsname == 'macro':
+        localname = '?' + sigdata.name
+    elif sigdata.nsname == 'rec':
+        localname = '#' + sigdata.name
+    else:
+        localname = sigdata.name
+    indextext = '%s; %s' % (sigdata.modname, _object_index_text(sigdata.decltype, localname))
+
+    seen = env.temp_data.setdefault('erl:indexed', set())
+    if indextext in seen:
+        return []
+    seen.add(indextext)
+    return [_indexentry('single', indextext, refname, fullname, None)]
 
-    def to_full_name(self):
-        return self.to_full_name_('', True)
+def _add_record_fields(env, document, objname, fields, add_target, lineno):
+    """
+    Register fields of the record objname in the current document, for the
+    field index looked up by :erl:field:.
 
-    def to_full_qualified_name(self):
-        if self.nsname == 'macro':
-            sigil = '?'
-        elif self.nsname == 'rec':
-            sigil = '#'
-        else:
-            # 'cb', 'fn', 'ty'
-            sigil = ''
-        return self.to_full_name_('', False)
-
-    def to_full_name_(self, sigil, creation):
-        if self.arity_max is not None and creation:
-            fullname = '%s:%s%s/%d..%d' % (self.modname, sigil, self.name, self.arity, self.arity_max)
-        elif self.arity is not None:
-            fullname = '%s:%s%s/%d'     % (self.modname, sigil, self.name, self.arity)
-        elif self.is_arglist_mandatory() and creation:
-            # arglist is mandatory. treat as no arguments.
-            fullname = '%s:%s%s/0' % (self.modname, sigil, self.name)
-        else:
-            fullname = '%s:%s%s'   % (self.modname, sigil, self.name)
+    fields are (name, default, typ, node) tuples.  add_target(refname, node)
+    makes the target of a field whose id is not in the document yet.
+    """
+    finv = env.domaindata['erl']['fields']
+    if objname in finv:
+        # another flavor of the record.
+        return
+    entries = {}
+    for (name, default, typ, node) in fields:
+        if name is None or name in entries:
+            continue
+        longname = 'erl.field.%s.%s' % (objname, name)
+        refname  = _object_id(env.config, longname)
+        _check_object_id(env, refname, longname, location=(env.docname, lineno))
+        if refname not in document.ids:
+            add_target(refname, node)
+        entries[name] = (env.docname, refname, default, typ)
+    finv[objname] = (env.docname, entries)
 
-        if self.flavor is not None:
-            fullname += '@%s' % (self.flavor)
-        return fullname
 
-    def mfa(self):
-        return (self.modname, self.name, self.arity)
+class ErlangObjectContext:
+    def __init__(self, objtype, sigdata):
+        self.objtype = objtype
+        self.sigdata = sigdata
 
-    @staticmethod
-    def drop_flavor_from_full_name(fullname):
-        return re.compile(r'@.*\Z').sub('', fullname, 1)
+    def refname(self):
+        return 'erl.%s.%s' % (self.sigdata.nsname, self.sigdata.to_full_name())
 
 class ErlangBaseObject(ObjectDescription):
     """
@@ -479,6 +540,7 @@ class ErlangBaseObject(ObjectDescription):
     def handle_signature(self, sig_text, signode):
         self.erl_sigdata    = None
         self.erl_env_object = None
+        self.erl_field_nodes = []
 
         self._setup_data(sig_text)
         self._construct_nodes(signode)
@@ -497,7 +559,7 @@ class ErlangBaseObject(ObjectDescription):
         try:
             sigdata = ErlangSignature.from_text(sig_text, nsname)
         except ValueError:
-            _warn(self.env,
+            _diagnose(self.env, 'invalid-signature',
                 'invalid signature for Erlang %s description: %s',
                 decltype,
                 sig_text,
@@ -515,9 +577,8 @@ class ErlangBaseObject(ObjectDescription):
         elif self.options['module'] == sigdata.modname:
             pass
         else:
-            _warn(self.env,
-                'duplicate module specifier in signature and option',
-                decltype,
+            _diagnose(self.env, 'duplicate-module-specifier',
+                'duplicate module specifier in signature and option: %s',
                 sig_text,
                 location=(self.env.docname, self.lineno))
 
@@ -526,7 +587,7 @@ class ErlangBaseObject(ObjectDescription):
             if sigdata.flavor is None:
                 sigdata.flavor = self.options['flavor']
             elif sigdata.flavor != self.options['flavor']:
-                _warn(self.env,
+                _diagnose(self.env, 'inconsistent-flavor',
                     'inconsistent flavor, %s in signature and %s in option.',
                     sigdata.flavor,
                     self.options['flavor'],
@@ -535,11 +596,11 @@ class ErlangBaseObject(ObjectDescription):
 
         if env_object is not None:
             if sigdata.mfa() != env_object.sigdata.mfa():
-                _warn(self.env,
+                _diagnose(self.env, 'inconsistent-clause',
                     'inconsistent %s clause, got %s for %s.',
                     env_object.objtype,
-                    '%s:%s/%d' % sigdata.mfa(),
-                    '%s:%s/%d' % obj_object.sigdata.mfa(),
+                    '%s:%s/%s' % sigdata.mfa(),
+                    '%s:%s/%s' % env_object.sigdata.mfa(),
                     location=(self.env.docname, self.lineno))
                 raise ValueError
 
@@ -559,19 +620,26 @@ class ErlangBaseObject(ObjectDescription):
         modname_part = '%s:' % (sigdata.modname,)
         signode += addnodes.desc_addname(modname_part, modname_part)
 
-        name_part = sigdata.to_desc_name()
+        if sigdata.rec_decl is not None:
+            name_part = '#%s' % (sigdata.name,)
+        else:
+            name_part = sigdata.to_desc_name()
         signode += addnodes.desc_name(name_part, name_part)
 
+        if sigdata.rec_decl is not None:
+            signode += self._record_body_node(sigdata)
+
         if sigdata.arg_list is not None:
             paramlist_node = addnodes.desc_parameterlist()
             signode += paramlist_node
             last_node = paramlist_node
             for (req, txt) in sigdata.arg_list:
+                param = addnodes.desc_parameter(txt, '', *self._type_nodes(txt))
                 if req == 'mandatory':
-                    last_node += addnodes.desc_parameter(txt, txt)
+                    last_node += param
                 else:
                     opt = addnodes.desc_optional()
-                    opt += addnodes.desc_parameter(txt, txt)
+                    opt += param
                     last_node += opt
                     last_node = opt
 
@@ -581,112 +649,92 @@ class ErlangBaseObject(ObjectDescription):
 
         if sigdata.when_text is not None:
             when_text = ' when %s' % (sigdata.when_text,)
-            signode += nodes.emphasis(when_text, when_text)
+            signode += nodes.emphasis(when_text, '', *self._type_nodes(when_text))
 
         if sigdata.ret_ann:
-            signode += addnodes.desc_returns(sigdata.ret_ann, sigdata.ret_ann)
+            signode += addnodes.desc_returns(sigdata.ret_ann, '',
+                                             *self._type_nodes(sigdata.ret_ann))
+
+    def _record_body_node(self, sigdata):
+        body = nodes.inline('{ %s }' % (sigdata.rec_decl,), '')
+        body += nodes.Text('{ ')
+        for (n, field) in enumerate(sigdata.rec_fields):
+            if n > 0:
+                body += nodes.Text(', ')
+            (name, default, typ, text) = field
+            field_node = nodes.inline(text, '', *self._type_nodes(text))
+            body += field_node
+            if name is not None:
+                # get a target by _add_field_targets.
+                self.erl_field_nodes.append((field, field_node))
+        body += nodes.Text(' }')
+        return body
+
+    def _type_nodes(self, text):
+        if not self.env.config.erl_signature_type_links:
+            return [nodes.Text(text)]
+        return list(type_reference_nodes(text, self.erl_sigdata.modname))
+
 
+    def run(self):
+        self.erl_refnames = []
+        return super(ErlangBaseObject, self).run()
 
     def add_target_and_index(self, fullname, sig_text, signode):
-        refname = 'erl.%s.%s' % (self.erl_sigdata.nsname, fullname)
-        self._add_target(refname, signode)
-        self._add_index(refname, fullname)
+        refnames = _object_ids(self.env.config, self.erl_sigdata.nsname, fullname)
+        self._add_target(refnames, signode)
+        self._add_index(refnames[0], fullname)
+        self.erl_refnames.extend(refnames)
 
-    def _add_target(self, refname, signode):
+    def _add_target(self, refnames, signode):
+        refname = refnames[0]
         signode['first'] = (not self.names)
         if refname not in self.state.document.ids:
-            signode['names'].append(refname)
-            signode['ids'].append(refname)
-            refname_2 = ErlangSignature.drop_flavor_from_full_name(refname)
-            if refname_2 != refname and refname_2 not in self.state.document.ids:
-                signode['names'].append(refname_2)
-                signode['ids'].append(refname_2)
+            for refname_2 in refnames:
+                if refname_2 not in self.state.document.ids:
+                    signode['names'].append(refname_2)
+                    signode['ids'].append(refname_2)
             self.state.document.note_explicit_target(signode)
 
         sigdata = self.erl_sigdata
-        objname = '%s:%s' % (sigdata.modname, sigdata.name)
-        if sigdata.arity_max is not None:
-            arity_range = range(sigdata.arity, sigdata.arity_max + 1)
-        elif sigdata.arity is not None:
-            arity_range = [sigdata.arity]
-        elif sigdata.is_arglist_mandatory():
-            # arglist is mandatory. treat as no arguments.
-            arity_range = [0]
-        else:
-            # no arglist portion.
-            arity_range = [None]
+        domain  = self.env.get_domain('erl')
+        registered = domain.add_object(sigdata, refname, self.env.docname,
+                                       self.lineno, 'deprecated' in self.options)
+        if registered and sigdata.nsname == 'rec' and \
+                not domain.is_delta_version(domain.version_of(self.env.docname)):
+            self._add_field_targets('%s:%s' % (sigdata.modname, sigdata.name))
 
-        oinv = self.env.domaindata['erl']['objects'][sigdata.nsname]
-        arities = oinv.setdefault(objname, {})
+    def _add_field_targets(self, objname):
+        document = self.state.document
 
-        deprecated = 'deprecated' in self.options
-        for arity in arity_range:
-            new_entry = ObjectEntry(self.env.docname, deprecated, sigdata, refname, self.lineno)
-            arities.setdefault(arity, {})
-            if sigdata.flavor not in arities[arity]:
-                # ok. register entry.
-                arities[arity][sigdata.flavor] = new_entry
-
-                if None not in arities[arity]:
-                    s2 = copy.copy(sigdata)
-                    s2.flavor = None
-                    e2 = new_entry.copy(s2)
-                    e2.refname  = 'erl.%s.%s' % (s2.nsname, s2.to_full_name())
-                    arities[arity][None] = e2
-                continue
+        def add_target(refname, field_node):
+            field_node['names'].append(refname)
+            field_node['ids'].append(refname)
+            document.note_explicit_target(field_node)
 
-            # ng. warn duplicate.
-            prev_entry = arities[arity][sigdata.flavor]
-
-            if arity is None:
-                name_tmp = '%s:%s'    % (sigdata.modname, sigdata.name)
-            else:
-                name_tmp = '%s:%s/%d' % (sigdata.modname, sigdata.name, arity)
-            if sigdata.flavor:
-                name_tmp += ' {flavor=%s}' % (sigdata.flavor,)
-            _warn(self.env,
-                'duplicate Erlang %s description of %s, '
-                'other instance in %s line %d.',
-                sigdata.decltype,
-                name_tmp,
-                self.env.doc2path(prev_entry.docname),
-                prev_entry.lineno,
-                location=(self.env.docname, self.lineno))
-        if not arities:
-            del oinv[objname]
+        fields = [(name, default, typ, field_node)
+                  for ((name, default, typ, text), field_node) in self.erl_field_nodes]
+        _add_record_fields(self.env, document, objname, fields, add_target, self.lineno)
 
     def _add_index(self, refname, fullname):
-        indextext = self._compute_index_text(fullname)
-        self.indexnode['entries'].append(_indexentry('single', indextext, refname, fullname, None))
-
-
-    def _compute_index_text(self, name):
-        decltype = self.erl_sigdata.decltype
-
-        if decltype == 'callback':
-            return _('%s (Erlang callback function)') % name
-        elif decltype == 'function':
-            return _('%s (Erlang function)') % name
-        elif decltype == 'macro':
-            return _('%s (Erlang macro)') % name
-        elif decltype == 'opaque':
-            return _('%s (Erlang opaque type)') % name
-        elif decltype == 'record':
-            return _('%s (Erlang record)') % name
-        elif decltype == 'type':
-            return _('%s (Erlang type)') % name
-        else:
-            raise ValueError
+        self.indexnode['entries'].extend(
+            _object_index_entries(self.env, self.erl_sigdata, refname, fullname))
 
 class ErlangObject(ErlangBaseObject):
     def handle_signature(self, sig_text, signode):
         if 'erl:object' in _ref_context(self.env):
-            _warn(self.env,
+            _diagnose(self.env, 'nested-directive',
                 'nested directive may cause undefined behavior.',
                 location=(self.env.docname, self.lineno))
 
         return super(ErlangObject, self).handle_signature(sig_text, signode)
 
+    def run(self):
+        result = super(ErlangObject, self).run()
+        if self.env.config.erl_backlinks and self.erl_refnames:
+            # the last child of desc is desc_content.
+            result[-1][-1] += erl_backlinks(refnames=self.erl_refnames)
+        return result
 
     def before_content(self):
         _ref_context(self.env)['erl:object'] = ErlangObjectContext(self.objtype, self.erl_sigdata)
@@ -712,7 +760,7 @@ class ErlangClauseObject(ErlangBaseObject):
 
     def handle_signature(self, sig_text, signode):
         if not self._is_valid_location():
-            _warn(self.env,
+            _diagnose(self.env, 'misplaced-clause',
                 'clause directive must be a descendant of function or callback.',
                 location=(self.env.docname, self.lineno))
             raise ValueError
@@ -720,6 +768,112 @@ class ErlangClauseObject(ErlangBaseObject):
         return  super(ErlangClauseObject, self).handle_signature(sig_text, signode)
 
 
+class ErlangClauses(Directive):
+    """
+    Directive to describe clauses of a function or a callback compactly.
+
+    Each line without indentation is a clause signature, and following
+    indented lines are its description.  Clauses are rendered as a table,
+    without index entries.
+    """
+
+    has_content = True
+    required_arguments = 0
+    optional_arguments = 0
+    final_argument_whitespace = False
+    option_spec = {}
+
+    def run(self):
+        self.env = self.state.document.settings.env
+        parent   = _ref_context(self.env).get('erl:object')
+        if parent is None or parent.objtype not in ('function', 'callback'):
+            _diagnose(self.env, 'misplaced-clause',
+                'clause directive must be a descendant of function or callback.',
+                location=(self.env.docname, self.lineno))
+            return []
+
+        tbody = nodes.tbody()
+        for (sig_text, lineno, description) in self._split_content():
+            sigdata = self._parse_clause(parent, sig_text, lineno)
+            if sigdata is None:
+                continue
+            desc = nodes.entry()
+            if description:
+                self.state.nested_parse(description, description.offset(0), desc)
+            tbody += nodes.row('', nodes.entry('', self._clause_node(sigdata)), desc)
+            if sigdata.flavor is not None:
+                self._add_target(sigdata, lineno, tbody[-1])
+
+        if not len(tbody):
+            return []
+        tgroup = nodes.tgroup(cols=2)
+        tgroup += nodes.colspec(colwidth=1)
+        tgroup += nodes.colspec(colwidth=1)
+        tgroup += tbody
+        return [nodes.table('', tgroup, classes=['erl-clauses'])]
+
+    def _split_content(self):
+        # :: [(signature, lineno, StringList of the description)]
+        starts = [i for i, line in enumerate(self.content) if line[:1].strip()]
+        clauses = []
+        for (start, end) in zip(starts, starts[1:] + [len(self.content)]):
+            description = self.content[start + 1:end].get_indented()[0]
+            clauses.append((self.content[start].strip(),
+                            self.content_offset + start + 1,
+                            description))
+        return clauses
+
+    def _parse_clause(self, parent, sig_text, lineno):
+        # validated against the signature of the parent.
+        try:
+            sigdata = ErlangSignature.from_text(sig_text, parent.sigdata.nsname)
+        except ValueError:
+            sigdata = None
+        if sigdata is None or sigdata.modname not in (None, parent.sigdata.modname):
+            _diagnose(self.env, 'invalid-signature',
+                'invalid signature for Erlang %s description: %s',
+                parent.objtype,
+                sig_text,
+                location=(self.env.docname, lineno))
+            return None
+        sigdata.modname  = parent.sigdata.modname
+        sigdata.decltype = parent.objtype
+        if sigdata.mfa() != parent.sigdata.mfa():
+            _diagnose(self.env, 'inconsistent-clause',
+                'inconsistent %s clause, got %s for %s.',
+                parent.objtype,
+                '%s:%s/%s' % sigdata.mfa(),
+                '%s:%s/%s' % parent.sigdata.mfa(),
+                location=(self.env.docname, lineno))
+            return None
+        return sigdata
+
+    def _clause_node(self, sigdata):
+        # in the same order as signatures, without the module name.
+        text = sigdata.local_disp_name_()
+        if sigdata.flavor is not None and sigdata.explicit_flavor:
+            text += '@%s' % (sigdata.flavor,)
+        if sigdata.when_text is not None:
+            text += ' when %s' % (sigdata.when_text,)
+        if sigdata.ret_ann is not None:
+            text += ' -> %s' % (sigdata.ret_ann,)
+        node = nodes.literal(classes=['erl-clause'])
+        if self.env.config.erl_signature_type_links:
+            node.extend(type_reference_nodes(text, sigdata.modname))
+        else:
+            node += nodes.Text(text)
+        return nodes.paragraph('', '', node)
+
+    def _add_target(self, sigdata, lineno, row):
+        # flavored clauses can be referenced, e.g. 'mod:name/2@flavor'.
+        refname = _object_ids(self.env.config, sigdata.nsname, sigdata.to_full_name())[0]
+        if refname not in self.state.document.ids:
+            row['names'].append(refname)
+            row['ids'].append(refname)
+            self.state.document.note_explicit_target(row)
+        self.env.get_domain('erl').add_object(sigdata, refname, self.env.docname, lineno)
+
+
 class ErlangModule(Directive):
     """
     Directive to mark description of a new module.
@@ -734,6 +888,9 @@ class ErlangModule(Directive):
         'synopsis'  : directives.unchanged,
         'noindex'   : directives.flag,
         'deprecated': directives.flag,
+        'behaviour' : directives.unchanged,
+        'behavior'  : directives.unchanged,
+        'application': directives.unchanged,
     }
 
     def run(self):
@@ -744,7 +901,7 @@ class ErlangModule(Directive):
             modname = ErlangSignature.canon_atom(modname)
             modname_error = False
         except ValueError:
-            _warn(self.env,
+            _diagnose(self.env, 'invalid-module-name',
                 'invalid Erlang module name: %s',
                 modname,
                 location=(self.env.docname, self.lineno))
@@ -760,26 +917,57 @@ class ErlangModule(Directive):
         self.state.document.note_explicit_target(targetnode)
 
         if not modname_error:
-            minv = self.env.domaindata['erl']['modules']
-            if modname not in minv:
-                minv[modname] = (
-                    self.env.docname,
-                    self.options.get('synopsis', ''),
-                    self.options.get('platform', ''),
-                    'deprecated' in self.options)
-            else:
-                _warn(self.env,
-                    'duplicate Erlang module name of %s, other instance in %s.',
-                    modname,
-                    self.env.doc2path(minv[modname][0]),
-                    location=(self.env.docname, self.lineno))
+            location = (self.env.docname, self.lineno)
+            self.env.get_domain('erl').add_module(
+                modname, self.env.docname, self.lineno,
+                self.options.get('synopsis', ''),
+                self.options.get('platform', ''),
+                'deprecated' in self.options,
+                _module_application(self.env, self.options, location),
+                _module_behaviours(self.env, self.options, location))
+
+        inode = addnodes.index(entries=_module_index_entries(self.env, modname))
+        return [targetnode, inode]
 
-        # the synopsis isn't printed; in fact, it is only used in the
-        # modindex currently
+
+def _module_index_entries(env, modname):
+    # the synopsis isn't printed; in fact, it is only used in the
+    # modindex currently
+    if env.config.erl_index_grouped:
+        # the group head of objects in the module.
+        indextext = modname
+    else:
         indextext = _('%s (Erlang module)') % modname
-        inode = addnodes.index(entries=[_indexentry('single', indextext,
-                                             'module-' + modname, modname, None)])
-        return [targetnode, inode]
+    return [_indexentry('single', indextext, 'module-' + modname, modname, None)]
+
+def _module_application(env, options, location):
+    appname = options.get('application', '').strip()
+    if not appname:
+        return None
+    try:
+        return ErlangSignature.canon_atom(appname)
+    except ValueError:
+        _diagnose(env, 'invalid-application',
+            'invalid Erlang application name: %s',
+            appname,
+            location=location)
+        return None
+
+def _module_behaviours(env, options, location):
+    names = []
+    for option in ('behaviour', 'behavior'):
+        for name in options.get(option, '').split(','):
+            name = name.strip()
+            if not name:
+                continue
+            try:
+                names.append(ErlangSignature.canon_atom(name))
+            except ValueError:
+                _diagnose(env, 'invalid-behaviour',
+                    'invalid Erlang behaviour name: %s',
+                    name,
+                    location=location)
+    return names
 
 
 class ErlangCurrentModule(Directive):
@@ -804,10 +992,56 @@ class ErlangCurrentModule(Directive):
         return []
 
 
+class ErlangObjectList(Directive):
+    """
+    Directive to list objects matching a pattern, with links to them.
+    """
+
+    has_content = False
+    required_arguments = 1
+    optional_arguments = 0
+    final_argument_whitespace = False
+    option_spec = {
+        'type': directives.unchanged,
+    }
+
+    def run(self):
+        env     = self.state.document.settings.env
+        pattern = self.arguments[0].strip()
+        typ     = self.options.get('type', 'func').strip()
+        modname = _ref_context(env).get('erl:module')
+        if typ not in ErlangObject.NAMESPACE_FROM_ROLE:
+            _diagnose(env, 'invalid-pattern',
+                'invalid type of Erlang object list: %s',
+                typ,
+                location=(env.docname, self.lineno))
+            return []
+        if _parse_pattern(pattern, modname) is None:
+            _diagnose(env, 'invalid-pattern',
+                'invalid pattern of Erlang object list: %s',
+                pattern,
+                location=(env.docname, self.lineno))
+            return []
+
+        key = (typ, modname, pattern)
+        # the matched refnames are filled by ErlangDomain.update_listings.
+        env.domaindata['erl']['listings'].setdefault(env.docname, {})[key] = None
+        node = erl_objectlist(**{'erl:key': key})
+        node.line = self.lineno
+        return [node]
+
+
 class ErlangXRefRole(XRefRole):
     def process_link(self, env, refnode, has_explicit_title, title, target):
         refnode['erl:module'] = _ref_context(env).get('erl:module')
+        if 'erl:object' in _ref_context(env):
+            refnode['erl:object'] = _ref_context(env)['erl:object'].refname()
+        version = env.get_domain('erl').version_of(env.docname)
+        if version is not None:
+            refnode['erl:version'] = version
         if not has_explicit_title:
+            # 'lists:append/2~1.0' is shown as 'lists:append/2'.
+            title = _split_version(env.config, title)[0]
             title = title.lstrip(':')   # only has a meaning for the target
             target = target.lstrip('~') # only has a meaning for the title
             # if the first character is a tilde, don't display the module/class
@@ -831,71 +1065,157 @@ class ErlangModuleIndex(Index):
     shortname = l_('modules')
 
     def generate(self, docnames=None):
-        content = {}
-        # list of prefixes to ignore
-        ignores = self.domain.env.config['modindex_common_prefix']
-        ignores = sorted(ignores, key=len, reverse=True)
-        # list of all modules, sorted by module name
-        modules = sorted(_iteritems(self.domain.data['modules']),
-                         key=lambda x: x[0].lower())
-        # sort out collapsable modules
-        prev_modname = ''
+        domain = self.domain
+        trie   = domain._prefix_trie()
+        if docnames:
+            modules = domain._modules_of_docs(docnames)
+        else:
+            modules = domain._iter_modules()
+
+        # :: first letter -> [(sort key, rows)]
+        letters = {}
+        # :: application name -> rows, the group head comes first.
+        groups  = {}
         num_toplevels = 0
+        num_grouped   = 0
+        # data['module_order'] is kept sorted by module name.
         for modname, (docname, synopsis, platforms, deprecated) in modules:
-            if docnames and docname not in docnames:
-                continue
+            stripped = trie.longest_prefix(modname)
+            localname = modname[len(stripped):]
+            # we stripped the whole module name?
+            if not localname:
+                localname = modname
 
-            for ignore in ignores:
-                if modname.startswith(ignore):
-                    modname = modname[len(ignore):]
-                    stripped = ignore
-                    break
-            else:
-                stripped = ''
+            qualifier = deprecated and _('Deprecated') or ''
+            row = [modname, 0, docname, 'module-' + modname, platforms,
+                   qualifier, synopsis]
 
-            # we stripped the whole module name?
-            if not modname:
-                modname, stripped = stripped, ''
-
-            entries = content.setdefault(modname[0].lower(), [])
-
-            package = modname.split(':', 1)[0]
-            if package != modname:
-                # it's a submodule
-                if prev_modname == package:
-                    # first submodule - make parent a group head
-                    entries[-1][1] = 1
-                elif not prev_modname.startswith(package):
-                    # submodule without parent in list, add dummy entry
-                    entries.append([stripped + package, 1, '', '', '', '', ''])
-                subtype = 2
-            else:
+            appname = domain.application_of(modname)
+            if appname is None:
                 num_toplevels += 1
-                subtype = 0
+                letters.setdefault(localname[0].lower(), []).append(
+                    (localname.lower(), [row]))
+                continue
 
-            qualifier = deprecated and _('Deprecated') or ''
-            entries.append([stripped + modname, subtype, docname,
-                            'module-' + stripped + modname, platforms,
-                            qualifier, synopsis])
-            prev_modname = modname
+            num_grouped += 1
+            row[1] = 2
+            if appname not in groups:
+                num_toplevels += 1
+                groups[appname] = [[appname, 1, '', '', '', '', '']]
+                letters.setdefault(appname[0].lower(), []).append(
+                    (appname.lower(), groups[appname]))
+            groups[appname].append(row)
 
         # apply heuristics when to collapse modindex at page load:
-        # only collapse if number of toplevel modules is larger than
-        # number of submodules
-        collapse = len(modules) - num_toplevels < num_toplevels
+        # only collapse if number of toplevel entries is larger than
+        # number of modules in applications
+        collapse = num_grouped < num_toplevels
 
         # sort by first letter
-        content = sorted(_iteritems(content))
+        content = []
+        for letter in sorted(letters):
+            rows = []
+            for (sortkey, group) in sorted(letters[letter], key=lambda x: x[0]):
+                rows.extend(group)
+            content.append((letter, rows))
 
         return content, collapse
 
+
+class _PrefixTrie(object):
+    """
+    Longest prefix lookup for modindex_common_prefix.
+    """
+
+    def __init__(self, prefixes):
+        self.root = {}
+        for prefix in prefixes:
+            if not prefix:
+                continue
+            node = self.root
+            for c in prefix:
+                node = node.setdefault(c, {})
+            # the terminal mark.
+            node[None] = prefix
+
+    def longest_prefix(self, text):
+        node  = self.root
+        found = ''
+        for c in text:
+            node = node.get(c)
+            if node is None:
+                break
+            if None in node:
+                found = node[None]
+        return found
+
+
+class ErlangBehaviourIndex(Index):
+    """
+    Index subclass to provide the Erlang behaviour index.
+    """
+
+    name = 'behaviourindex'
+    localname = l_('Erlang Behaviour Index')
+    shortname = l_('behaviours')
+
+    def generate(self, docnames=None):
+        content   = {}
+        modules   = dict(self.domain._iter_modules())
+        callbacks, iinv = self.domain._behaviour_tables()
+
+        for behaviour in sorted(set(callbacks) | set(iinv)):
+            cbs   = callbacks.get(behaviour, {})
+            impls = iinv.get(behaviour, {})
+            if docnames:
+                related = set(d for (d, refname) in cbs.values())
+                related.update(impls.values())
+                if behaviour in modules:
+                    related.add(modules[behaviour][0])
+                if not related & set(docnames):
+                    continue
+
+            entries = content.setdefault(behaviour.strip("'")[0].lower(), [])
+            if behaviour in modules:
+                entries.append([behaviour, 1, modules[behaviour][0],
+                                'module-' + behaviour, '', '',
+                                modules[behaviour][1]])
+            else:
+                entries.append([behaviour, 1, '', '', '', '', ''])
+
+            for name in sorted(cbs, key=_callback_key):
+                docname, refname = cbs[name]
+                entries.append([name, 2, docname, refname,
+                                _('callback'), '', ''])
+            for modname in sorted(impls):
+                entries.append([modname, 2, impls[modname],
+                                'module-' + modname,
+                                _('implementation'), '', ''])
+
+        return sorted(_iteritems(content)), False
+
+
+def _callback_key(name):
+    # 'mod:name/arity'
+    (prefix, _sep, arity) = name.rpartition('/')
+    return (prefix, int(arity) if arity.isdigit() else -1)
+
+
 class ObjectEntry:
+    # True for the flavor-less copy of a flavored object made by
+    # ErlangDomain.add_object.  a class attribute, so that entries of other
+    # objects do not carry it.
+    twin = False
+
     def __init__(self, docname, deprecated, sigdata, refname, lineno):
         self.docname    = docname
         self.deprecated = deprecated
         self.sigdata    = sigdata
         self.refname    = refname
         self.lineno     = lineno
+        # :: [version] of erl_versions in that order, or None if the entry
+        # is not in a versioned document.
+        self.versions   = None
 
         self.dispname = sigdata.to_disp_name()
         if deprecated:
@@ -904,13 +1224,16 @@ class ObjectEntry:
         self.objtype  = sigdata.decltype
 
     def copy(self, sigdata):
-        return ObjectEntry(
+        entry = ObjectEntry(
                 self.docname,
                 self.deprecated,
                 sigdata,
                 self.refname,
                 self.lineno,
             )
+        entry.versions = self.versions and list(self.versions)
+        entry.twin     = self.twin
+        return entry
 
     def intersphinx_names(self, arity, flavor):
         # Create canoninal and variation names.
@@ -958,10 +1281,86 @@ class ObjectEntry:
                     ])
                     yield invname
 
-    def to_intersphinx_target(self, fullname):
+    def sort_key(self):
+        return (self.docname, self.lineno)
+
+    def canonical_name(self, arity):
+        # 'mod:name/arity', or 'mod:name' when arity is None.
+        # no sigils, no argument names and no flavors.
+        if arity is None:
+            return '%s:%s' % (self.sigdata.modname, self.sigdata.name)
+        else:
+            return '%s:%s/%d' % (self.sigdata.modname, self.sigdata.name, arity)
+
+    def to_intersphinx_target(self, fullname, priority=1):
         # '1' means default search priority.
         # See sphinx.domains.Domain#get_objects.
-        return (fullname, fullname, self.objtype, self.docname, self.refname, 1)
+        return (fullname, fullname, self.objtype, self.docname, self.refname, priority)
+
+
+def _parse_pattern(target, env_modname):
+    # :: (modname, name prefix, exact, arity) or None if not a pattern.
+    # 'gen_server:start*', 'lists:foldl/*' and 'lists:fold*/3'.  arity is
+    # None for the first arity of each name, '*' for all arities.
+    if '*' not in target:
+        return None
+    m = RE_PATTERN_TARGET.match(target)
+    if not m:
+        return None
+    try:
+        if m.group('modname') is None:
+            modname = env_modname
+        else:
+            modname = ErlangSignature.canon_atom(m.group('modname'))
+    except ValueError:
+        return None
+    if modname is None:
+        return None
+    arity = m.group('arity')
+    if arity is not None and arity != '*':
+        arity = int(arity)
+    exact = m.group('star') is None
+    if exact and (arity != '*' or not m.group('prefix')):
+        # no wildcard in the name nor in the arity.
+        return None
+    return modname, m.group('prefix'), exact, arity
+
+def _split_version(config, target):
+    # 'lists:append/2~1.0' -> ('lists:append/2', '1.0'), for a version of
+    # erl_versions.
+    (head, sep, tail) = target.rpartition('~')
+    if sep and head and tail in dict(config.erl_versions):
+        return head, tail
+    return target, None
+
+def _iter_table(objects):
+    # :: ((nsname, objname, arity, flavor), ObjectEntry)
+    for nsname, oinv in _iteritems(objects):
+        for objname, arities in _iteritems(oinv):
+            for arity, flavors in _iteritems(arities):
+                for flavor, entry in _iteritems(flavors):
+                    yield (nsname, objname, arity, flavor), entry
+
+def _get_entry(objects, key):
+    (nsname, objname, arity, flavor) = key
+    return objects[nsname].get(objname, {}).get(arity, {}).get(flavor)
+
+def _set_entry(objects, key, entry):
+    (nsname, objname, arity, flavor) = key
+    objects[nsname].setdefault(objname, {}).setdefault(arity, {})[flavor] = entry
+
+def _remove_entries(objects, predicate):
+    # remove entries for which predicate(key, entry) is true, and
+    # empty tables.
+    for key, entry in list(_iter_table(objects)):
+        if predicate(key, entry):
+            (nsname, objname, arity, flavor) = key
+            arities = objects[nsname][objname]
+            del arities[arity][flavor]
+            if not arities[arity]:
+                del arities[arity]
+            if not arities:
+                del objects[nsname][objname]
 
 
 class ErlangDomain(Domain):
@@ -978,12 +1377,14 @@ class ErlangDomain(Domain):
         'record'  : ObjType(l_('record'),            'record'  ),
         'type'    : ObjType(l_('type'),              'type'    ),
         'module'  : ObjType(l_('module'),            'mod'     ),
+        'field'   : ObjType(l_('record field'),      'field'   ),
     }
 
     # directive name is used for directive#objtype.
     directives = {
         'callback'     : ErlangObject,
         'clause'       : ErlangClauseObject,
+        'clauses'      : ErlangClauses,
         'function'     : ErlangObject,
         'macro'        : ErlangObject,
         'opaque'       : ErlangObject,
@@ -991,6 +1392,7 @@ class ErlangDomain(Domain):
         'type'         : ErlangObject,
         'module'       : ErlangModule,
         'currentmodule': ErlangCurrentModule,
+        'objectlist'   : ErlangObjectList,
     }
 
     roles = {
@@ -1000,6 +1402,7 @@ class ErlangDomain(Domain):
         'record'  : ErlangXRefRole(),
         'type'    : ErlangXRefRole(),
         'mod'     : ErlangXRefRole(),
+        'field'   : ErlangXRefRole(),
     }
     initial_data = {
         'objects'   : {
@@ -1012,46 +1415,692 @@ class ErlangDomain(Domain):
             'ty'    : {},
         },
         'modules'   : {}, # modname -> docname, synopsis, platform, deprecated
+        # :: [(lower modname, modname)], sorted.
+        'module_order': [],
+        # :: modname -> application name, by :application: option.
+        'applications': {},
+        # :: 'mod:record' -> (docname, field name -> (docname, refname, default, type)),
+        # docname is of the record, even if it has no fields.
+        'fields'    : {},
+        # :: behaviour modname -> 'mod:name/arity' -> (docname, refname)
+        'callbacks' : {},
+        # :: docname -> [(source refname, role, env_modname, target)]
+        'references': {},
+        # :: docname -> refname -> [(source docname, source refname)]
+        'backlinks' : {},
+        # :: docname -> (role, env_modname, pattern) -> [refname] or None
+        # object lists of documents, the refnames are the matched objects.
+        'listings'  : {},
+        # :: docname -> [diagnostic], see _diagnose.
+        'diagnostics': {},
+        # :: version -> {'objects', 'modules', 'applications', 'callbacks',
+        #                'implementations': same as above}
+        # the delta of each version of erl_versions from the base version,
+        # which is stored in the tables above.
+        'versions'  : {},
+        # :: behaviour modname -> implementation modname -> docname
+        'implementations': {},
     }
-    data_version = 2
+    data_version = 13
     indices = [
         ErlangModuleIndex,
+        ErlangBehaviourIndex,
     ]
 
     def clear_doc(self, docname):
-        rmmods = []
-        for modname in self.data['modules']:
-            if self.data['modules'][modname][0] == docname:
-                rmmods.append(modname)
-        for modname in rmmods:
-            del self.data['modules'][modname]
-
-        for nsname, oinv in _iteritems(self.data['objects']):
-            rmfuncs = []
+        self.data['references'].pop(docname, None)
+        self.data['diagnostics'].pop(docname, None)
+        if getattr(self, '_diagnostic_ids_cache', None):
+            self._diagnostic_ids_cache.pop(docname, None)
+        self.data['listings'].pop(docname, None)
+
+        version = self.version_of(docname)
+        delta   = self.is_delta_version(version)
+        tables  = self.data['versions'].get(version) if delta else self.data
+
+        for objname, (fdocname, fields) in list(_iteritems(self.data['fields'])):
+            if fdocname == docname:
+                del self.data['fields'][objname]
+
+        if tables is not None:
+            rmmods = [modname for (modname, info) in _iteritems(tables['modules'])
+                      if info[0] == docname]
+            for modname in rmmods:
+                del tables['modules'][modname]
+                tables['applications'].pop(modname, None)
+                if not delta:
+                    self._remove_module_order(modname)
+
+            for behaviour, cbs in list(_iteritems(tables['callbacks'])):
+                for name in [n for (n, v) in _iteritems(cbs) if v[0] == docname]:
+                    del cbs[name]
+                if not cbs:
+                    del tables['callbacks'][behaviour]
+
+            for behaviour, impls in list(_iteritems(tables['implementations'])):
+                for modname in [m for (m, d) in _iteritems(impls) if d == docname]:
+                    del impls[modname]
+                if not impls:
+                    del tables['implementations'][behaviour]
+
+        if delta:
+            if tables is not None:
+                _remove_entries(tables['objects'],
+                                lambda key, entry: entry.docname == docname)
+
+            # unshare base entries of the document.
+            def unshare(key, entry):
+                if entry.versions and version in entry.versions and \
+                        self.version_docname(entry.docname, version) == docname:
+                    entry.versions.remove(version)
+                return False
+            _remove_entries(self.data['objects'], unshare)
+            return
+
+        def remove(key, entry):
+            if entry.docname != docname:
+                return False
+            # other versions lose the shared entry, give their own back.
+            for other in (entry.versions or [])[1:]:
+                e = entry.copy(entry.sigdata)
+                e.docname  = self.version_docname(entry.docname, other)
+                e.versions = [other]
+                _set_entry(self.version_table(other)['objects'], key, e)
+            return True
+        _remove_entries(self.data['objects'], remove)
+
+    def merge_domaindata(self, docnames, otherdata):
+        # on conflicts, keep the entry which a serial build would have kept,
+        # so that outputs do not depend on how documents are distributed.
+        minv = self.data['modules']
+        for modname, info in _iteritems(otherdata['modules']):
+            if info[0] not in docnames:
+                continue
+            if modname not in minv:
+                bisect.insort(self.data['module_order'], (modname.lower(), modname))
+            elif info[0] >= minv[modname][0]:
+                continue
+            minv[modname] = info
+            if modname in otherdata['applications']:
+                self.data['applications'][modname] = otherdata['applications'][modname]
+            else:
+                self.data['applications'].pop(modname, None)
+
+        for nsname, oinv in _iteritems(otherdata['objects']):
+            mine = self.data['objects'][nsname]
             for objname, arities in _iteritems(oinv):
-                rmarities = []
                 for arity, flavors in _iteritems(arities):
-                    rmflavors = []
                     for flavor, entry in _iteritems(flavors):
-                        if entry.docname == docname:
-                            rmflavors.append(flavor)
-                    for flavor in rmflavors:
-                        del oinv[objname][arity][flavor]
-                    if not oinv[objname][arity]:
-                        rmarities.append(arity)
-                for arity in rmarities:
-                    del oinv[objname][arity]
-                if not oinv[objname]:
-                    rmarities.append(objname)
-            for objname in rmfuncs:
-                del oinv[objname]
-
-    def _find_obj(self, env, env_modname, name, typ, searchorder=0):
+                        if entry.docname not in docnames:
+                            continue
+                        slot = mine.setdefault(objname, {}).setdefault(arity, {})
+                        prev = slot.get(flavor)
+                        if prev is None or entry.sort_key() < prev.sort_key():
+                            slot[flavor] = entry
+
+        for version, table in _iteritems(otherdata['versions']):
+            mine = self.version_table(version)
+            for modname, info in _iteritems(table['modules']):
+                if info[0] in docnames and (modname not in mine['modules'] or
+                                            info[0] < mine['modules'][modname][0]):
+                    mine['modules'][modname] = info
+                    if modname in table['applications']:
+                        mine['applications'][modname] = table['applications'][modname]
+                    else:
+                        mine['applications'].pop(modname, None)
+            self._merge_behaviours(docnames, mine, table)
+            for key, entry in _iter_table(table['objects']):
+                if entry.docname not in docnames:
+                    continue
+                prev = _get_entry(mine['objects'], key)
+                if prev is None or entry.sort_key() < prev.sort_key():
+                    _set_entry(mine['objects'], key, entry)
+
+        for objname, (docname, fields) in _iteritems(otherdata['fields']):
+            mine = self.data['fields'].get(objname)
+            if docname in docnames and (mine is None or docname < mine[0]):
+                self.data['fields'][objname] = (docname, fields)
+
+        for docname, refs in _iteritems(otherdata['references']):
+            if docname in docnames:
+                self.data['references'][docname] = refs
+
+        for docname, records in _iteritems(otherdata['diagnostics']):
+            if docname in docnames:
+                self.data['diagnostics'][docname] = records
+        self._diagnostic_ids_cache = None
+
+        for docname, listings in _iteritems(otherdata['listings']):
+            if docname in docnames:
+                self.data['listings'][docname] = listings
+
+        self._merge_behaviours(docnames, self.data, otherdata)
+
+    @staticmethod
+    def _merge_behaviours(docnames, tables, othertables):
+        # callbacks and implementations of the base or of a version.
+        for behaviour, cbs in _iteritems(othertables['callbacks']):
+            mine = tables['callbacks'].setdefault(behaviour, {})
+            for name, (docname, refname) in _iteritems(cbs):
+                if docname not in docnames:
+                    continue
+                if name not in mine or docname < mine[name][0]:
+                    mine[name] = (docname, refname)
+
+        for behaviour, impls in _iteritems(othertables['implementations']):
+            mine = tables['implementations'].setdefault(behaviour, {})
+            for modname, docname in _iteritems(impls):
+                if docname in docnames:
+                    mine[modname] = docname
+
+    def add_module(self, modname, docname, lineno, synopsis='', platform='',
+                   deprecated=False, application=None, behaviours=()):
+        """
+        Register a module described in a document.
+
+        Returns True if it is registered, a duplicate is warned.
+        """
+        version = self.version_of(docname)
+        delta   = self.is_delta_version(version)
+        # other versions than the base have tables of their own.
+        tables  = self.version_table(version) if delta else self.data
+        minv    = tables['modules']
+        # implementors are noted even if the module is a duplicate.
+        for behaviour in behaviours:
+            tables['implementations'].setdefault(behaviour, {})[modname] = docname
+
+        if modname in minv:
+            _diagnose(self.env, 'duplicate-module',
+                'duplicate Erlang module name of %s, other instance in %s.',
+                modname,
+                self.env.doc2path(minv[modname][0], None),
+                location=(docname, lineno),
+                key='module:%s' % (modname,))
+            return False
+
+        minv[modname] = (docname, synopsis, platform, deprecated)
+        if not delta:
+            bisect.insort(self.data['module_order'], (modname.lower(), modname))
+        if application is not None:
+            tables['applications'][modname] = application
+        return True
+
+    def add_object(self, sigdata, refname, docname, lineno, deprecated=False):
+        """
+        Register an object described at refname in a document.
+
+        Returns arities which are registered, duplicates are warned.
+        """
+        objname = '%s:%s' % (sigdata.modname, sigdata.name)
+        if sigdata.arity_max is not None:
+            arity_range = range(sigdata.arity, sigdata.arity_max + 1)
+        elif sigdata.arity is not None:
+            arity_range = [sigdata.arity]
+        elif sigdata.is_arglist_mandatory():
+            # arglist is mandatory. treat as no arguments.
+            arity_range = [0]
+        else:
+            # no arglist portion.
+            arity_range = [None]
+
+        version = self.version_of(docname)
+        delta   = self.is_delta_version(version)
+        # objects of other versions than the base are kept apart, and
+        # shared with the base later by compact_versions.
+        tables  = self.version_table(version) if delta else self.data
+        oinv    = tables['objects'][sigdata.nsname]
+        arities = oinv.setdefault(objname, {})
+
+        _check_object_id(self.env, refname,
+                         'erl.%s.%s' % (sigdata.nsname, sigdata.to_full_name()),
+                         location=(docname, lineno))
+
+        registered = []
+        for arity in arity_range:
+            new_entry = ObjectEntry(docname, deprecated, sigdata, refname, lineno)
+            if version is not None:
+                new_entry.versions = [version]
+            arities.setdefault(arity, {})
+            if sigdata.flavor not in arities[arity]:
+                # ok. register entry.
+                arities[arity][sigdata.flavor] = new_entry
+
+                if None not in arities[arity]:
+                    s2 = copy.copy(sigdata)
+                    s2.flavor = None
+                    e2 = new_entry.copy(s2)
+                    e2.twin = True
+                    if not self.env.config.erl_short_ids:
+                        e2.refname = 'erl.%s.%s' % (s2.nsname, s2.to_full_name())
+                    arities[arity][None] = e2
+
+                if sigdata.nsname == 'cb':
+                    self._note_callback(tables, arity, arities[arity][None])
+                registered.append(arity)
+                continue
+
+            # ng. warn duplicate.
+            prev_entry = arities[arity][sigdata.flavor]
+
+            if arity is None:
+                name_tmp = '%s:%s'    % (sigdata.modname, sigdata.name)
+            else:
+                name_tmp = '%s:%s/%d' % (sigdata.modname, sigdata.name, arity)
+            if sigdata.flavor:
+                name_tmp += ' {flavor=%s}' % (sigdata.flavor,)
+            where = self.env.doc2path(prev_entry.docname, None)
+            if prev_entry.lineno is not None:
+                # None for records of add_objects in an empty document.
+                where = '%s line %d' % (where, prev_entry.lineno)
+            _diagnose(self.env, 'duplicate-object',
+                'duplicate Erlang %s description of %s, '
+                'other instance in %s.',
+                sigdata.decltype,
+                name_tmp,
+                where,
+                location=(docname, lineno),
+                key='%s:%s' % (sigdata.nsname, name_tmp))
+        if not arities:
+            del oinv[objname]
+        return registered
+
+    def _note_callback(self, tables, arity, entry):
+        # maintain the per-behaviour index of ErlangBehaviourIndex.
+        callbacks = tables['callbacks'].setdefault(entry.sigdata.modname, {})
+        callbacks.setdefault(entry.canonical_name(arity), (entry.docname, entry.refname))
+
+    def add_objects(self, docname, records, modname='erlang', lineno=None):
+        """
+        Register modules and objects of a document in bulk, without
+        directives.
+
+        `records` are (objtype, argument, options) tuples as directives of
+        the domain get them, e.g. ``('module', 'lists', {'synopsis': '...'})``
+        or ``('function', 'append(List1, List2) -> List3', {})``.  Objects
+        without module name belong to the last module of the records, or to
+        `modname`.  Options are ``deprecated``, ``module`` and ``flavor`` of
+        objects, and ``synopsis``, ``platform``, ``deprecated``,
+        ``application`` and ``behaviour`` of modules.
+
+        The records are registered by ErlangBulkObjects while the document
+        is read, after it is cleared, so this can be called at
+        env-before-read-docs.  Records of a document not read in the build
+        are dropped at env-updated, its objects are kept from the last read.
+
+        `lineno` is the line of the document which diagnostics of the records
+        refer to, e.g. of a comment marking where they are generated.  By
+        default it is the last line, where their targets are appended.
+        """
+        self._pending_records().setdefault(docname, []).append(
+            (list(records), modname, lineno))
+
+    def object_ids(self, objtype, argument, options=None, modname='erlang'):
+        """
+        Ids of an object of add_objects, for a node emitted by a generator
+        to be the target of the object.
+        """
+        sigdata = _bulk_signature(objtype, argument, options or {}, modname)
+        return _object_ids(self.env.config, sigdata.nsname, sigdata.to_full_name())
+
+    def _pending_records(self):
+        # :: docname -> [(records, modname)] of add_objects.
+        pending = getattr(self, '_pending', None)
+        if pending is None:
+            pending = self._pending = {}
+        return pending
+
+    def version_of(self, docname):
+        """
+        Return the version of erl_versions which the document belongs to,
+        or None.
+        """
+        for version, prefix in self.env.config.erl_versions:
+            if docname.startswith(prefix):
+                return version
+        return None
+
+    def is_delta_version(self, version):
+        # versions other than the base are stored as deltas.
+        versions = self.env.config.erl_versions
+        return version is not None and version != versions[0][0]
+
+    def version_table(self, version):
+        if version not in self.data['versions']:
+            self.data['versions'][version] = {
+                'objects'        : dict((nsname, {}) for nsname in self.data['objects']),
+                'modules'        : {},
+                'applications'   : {},
+                'callbacks'      : {},
+                'implementations': {},
+            }
+        return self.data['versions'][version]
+
+    def version_docname(self, docname, version):
+        # the document of the same name in another version.
+        current = self.version_of(docname)
+        if current is None or version is None or current == version:
+            return docname
+        prefixes = dict(self.env.config.erl_versions)
+        return prefixes[version] + docname[len(prefixes[current]):]
+
+    def _arities(self, nsname, objname, version):
+        # :: arity -> flavor -> ObjectEntry, of objname in the version.
+        arities = self.data['objects'][nsname].get(objname, {})
+        if version is None:
+            return arities
+        merged = {}
+        for arity, flavors in _iteritems(arities):
+            shared = dict((flavor, entry) for flavor, entry in _iteritems(flavors)
+                          if entry.versions is None or version in entry.versions)
+            if shared:
+                merged[arity] = shared
+        delta = self.data['versions'].get(version, {}).get('objects', {})
+        for arity, flavors in _iteritems(delta.get(nsname, {}).get(objname, {})):
+            merged.setdefault(arity, {}).update(flavors)
+        return merged
+
+    def compact_versions(self):
+        """
+        Share base entries with other versions which have the same entries,
+        and leave only the differences in their tables.
+        """
+        order = [version for version, prefix in self.env.config.erl_versions]
+        for version in order[1:]:
+            table = self.data['versions'].get(version)
+            if table is None:
+                continue
+            def same(key, entry):
+                base = _get_entry(self.data['objects'], key)
+                if base is None or not base.versions or \
+                        entry.refname    != base.refname or \
+                        entry.deprecated != base.deprecated or \
+                        entry.dispname   != base.dispname or \
+                        entry.sigdata.when_text != base.sigdata.when_text or \
+                        entry.docname != self.version_docname(base.docname, version):
+                    return False
+                base.versions = sorted(set(base.versions) | set([version]),
+                                       key=order.index)
+                return True
+            _remove_entries(table['objects'], same)
+
+    def _delta_tables(self):
+        # :: [table] of data['versions'] in the order of erl_versions.
+        versions = self.data['versions']
+        return [versions[version] for (version, prefix) in self.env.config.erl_versions[1:]
+                if version in versions]
+
+    def _all_arities(self, nsname, objname, deltas):
+        # :: arity -> flavor -> ObjectEntry, of objname in all versions.
+        # the base entry comes first, then that of the earliest version.
+        arities = self.data['objects'][nsname].get(objname, {})
+        if not deltas:
+            return arities
+        merged = dict((arity, dict(flavors)) for (arity, flavors) in _iteritems(arities))
+        for table in deltas:
+            for arity, flavors in _iteritems(table['objects'][nsname].get(objname, {})):
+                slot = merged.setdefault(arity, {})
+                for flavor, entry in _iteritems(flavors):
+                    slot.setdefault(flavor, entry)
+        return merged
+
+    def _iter_entries(self, nsnames=None):
+        # :: (nsname, objname, arity, flavor, ObjectEntry)
+        # in canonical order, independent of document read order.  objects
+        # only in other versions than the base come from their deltas.
+        deltas = self._delta_tables()
+        for nsname in sorted(nsnames or self.data['objects']):
+            objnames = set(self.data['objects'][nsname])
+            for table in deltas:
+                objnames.update(table['objects'][nsname])
+            for objname in sorted(objnames):
+                arities = self._all_arities(nsname, objname, deltas)
+                for arity in sorted(arities, key=_arity_key):
+                    flavors = arities[arity]
+                    for flavor in sorted(flavors, key=_flavor_key):
+                        yield nsname, objname, arity, flavor, flavors[flavor]
+
+    def _iter_modules(self):
+        # :: (modname, (docname, synopsis, platform, deprecated)) in the
+        # order of data['module_order'], and modules only in other versions.
+        modules = self.data['modules']
+        others  = {}
+        for table in self._delta_tables():
+            for modname, info in _iteritems(table['modules']):
+                if modname not in modules:
+                    others.setdefault(modname, info)
+        order = self.data['module_order']
+        if others:
+            order = sorted(order + [(modname.lower(), modname) for modname in others])
+        for (sortkey, modname) in order:
+            yield modname, modules.get(modname) or others[modname]
+
+    def _modules_of_docs(self, docnames):
+        # :: [(modname, info)] of modules declared in the documents, in the
+        # order of _iter_modules.
+        index = getattr(self, '_doc_modules_cache', None)
+        if index is None:
+            # :: docname -> [(modname, info)]
+            index = {}
+            for modname, info in self._iter_modules():
+                index.setdefault(info[0], []).append((modname, info))
+            self._doc_modules_cache = index
+        modules = []
+        for docname in set(docnames):
+            modules.extend(index.get(docname, ()))
+        return sorted(modules, key=lambda item: (item[0].lower(), item[0]))
+
+    def _behaviour_tables(self):
+        # :: (callbacks, implementations) as in data, with those only in
+        # other versions.
+        result = []
+        for key in ('callbacks', 'implementations'):
+            merged = self.data[key]
+            deltas = [table[key] for table in self._delta_tables() if table[key]]
+            if deltas:
+                merged = dict((k, dict(v)) for (k, v) in _iteritems(merged))
+                for delta in deltas:
+                    for behaviour, names in _iteritems(delta):
+                        slot = merged.setdefault(behaviour, {})
+                        for name, value in _iteritems(names):
+                            slot.setdefault(name, value)
+            result.append(merged)
+        return tuple(result)
+
+    def _type_index(self):
+        # :: (modname, name, arity) -> (docname, refname, title)
+        # built once per build, see _clear_caches.
+        index = getattr(self, '_type_index_cache', None)
+        if index is None:
+            index = {}
+            for nsname, objname, arity, flavor, entry in self._iter_entries(['ty']):
+                if flavor is not None:
+                    continue
+                key = (entry.sigdata.modname, entry.sigdata.name, arity)
+                index[key] = (entry.docname, entry.refname,
+                              self._entry_title(entry))
+            self._type_index_cache = index
+        return index
+
+    def add_diagnostic(self, record):
+        """
+        Record a diagnostic of _diagnose.  Returns False if the document
+        has the same one already.
+        """
+        docname = record['docname']
+        cache = getattr(self, '_diagnostic_ids_cache', None)
+        if cache is None:
+            # :: docname -> set of _diagnostic_id, not a part of the environment.
+            cache = self._diagnostic_ids_cache = {}
+        ids = cache.get(docname)
+        if ids is None:
+            ids = cache[docname] = set(
+                _diagnostic_id(r) for r in self.data['diagnostics'].get(docname, []))
+        if _diagnostic_id(record) in ids:
+            return False
+        ids.add(_diagnostic_id(record))
+        self.data['diagnostics'].setdefault(docname, []).append(record)
+        return True
+
+    def _diagnostic_counts(self):
+        # :: code -> number of diagnostics in this process, for
+        # erl_warning_limit.  not a part of the environment.
+        counts = getattr(self, '_diagnostic_counts_cache', None)
+        if counts is None:
+            counts = self._diagnostic_counts_cache = {}
+        return counts
+
+    def _name_index(self, nsname):
+        # :: sorted ['mod:name'] of the namespace, for prefix scans.
+        # built once per build, see _clear_caches.
+        if getattr(self, '_name_index_cache', None) is None:
+            self._name_index_cache = {}
+        index = self._name_index_cache.get(nsname)
+        if index is None:
+            names = set(self.data['objects'][nsname])
+            for table in self._delta_tables():
+                names.update(table['objects'][nsname])
+            index = self._name_index_cache[nsname] = sorted(names)
+        return index
+
+    def find_matches(self, nsname, env_modname, pattern):
+        """
+        Yield (arity, ObjectEntry) of objects matching a pattern, e.g.
+        'gen_server:start*' or 'lists:foldl/*', in the canonical order.
+        """
+        parsed = _parse_pattern(pattern, env_modname)
+        if parsed is None:
+            return
+        (modname, prefix, exact, arity) = parsed
+
+        deltas = self._delta_tables()
+        names  = self._name_index(nsname)
+        key    = '%s:%s' % (modname, prefix)
+        i     = bisect.bisect_left(names, key)
+        while i < len(names) and names[i].startswith(key):
+            objname = names[i]
+            i += 1
+            if exact and objname != key:
+                break
+            arities = self._all_arities(nsname, objname, deltas)
+            if arity == '*':
+                selected = sorted(arities, key=_arity_key)
+            elif arity is None:
+                selected = [min(arities, key=_arity_key)]
+            elif arity in arities:
+                selected = [arity]
+            else:
+                continue
+            for a in selected:
+                entry = arities[a].get(None)
+                if entry is not None:
+                    yield a, entry
+
+    def update_listings(self):
+        """
+        Match object lists of all documents again.
+
+        Returns names of documents whose lists are changed.
+        """
+        changed = []
+        for docname in sorted(self.data['listings']):
+            listings = self.data['listings'][docname]
+            for key in listings:
+                (typ, env_modname, pattern) = key
+                nsname  = ErlangObject.namespace_of_role(typ)
+                matched = [entry.refname for arity, entry
+                           in self.find_matches(nsname, env_modname, pattern)]
+                if listings[key] != matched:
+                    listings[key] = matched
+                    if docname not in changed:
+                        changed.append(docname)
+        return changed
+
+    def _clear_caches(self):
+        self._name_index_cache = None
+        self._type_index_cache = None
+        self._application_cache = None
+        self._prefix_trie_cache = None
+        self._doc_modules_cache = None
+
+    def _remove_module_order(self, modname):
+        order = self.data['module_order']
+        key   = (modname.lower(), modname)
+        i     = bisect.bisect_left(order, key)
+        if i < len(order) and order[i] == key:
+            del order[i]
+
+    def _prefix_trie(self):
+        trie = getattr(self, '_prefix_trie_cache', None)
+        if trie is None:
+            trie = _PrefixTrie(self.env.config['modindex_common_prefix'])
+            self._prefix_trie_cache = trie
+        return trie
+
+    def application_of(self, modname):
+        """
+        Application name of a module, or None.
+
+        The :application: option of erl:module precedes
+        erl_module_applications.
+        """
+        appname = self.data['applications'].get(modname)
+        if appname is None and modname not in self.data['modules']:
+            # a module only in other versions.
+            for table in self._delta_tables():
+                appname = table['applications'].get(modname)
+                if appname is not None:
+                    break
+        if appname is not None:
+            return appname
+        appmap = getattr(self, '_application_cache', None)
+        if appmap is None:
+            # :: modname -> application name
+            appmap = {}
+            for appname, modnames in _iteritems(self.env.config.erl_module_applications):
+                for name in modnames:
+                    appmap[name] = appname
+            self._application_cache = appmap
+        return appmap.get(modname)
+
+    @staticmethod
+    def _parse_field_target(env_modname, target):
+        # :: ('mod:record', field name) or None
+        m = RE_FIELD_TARGET.match(target)
+        if not m:
+            return None
+        try:
+            modname = m.group('modname') and ErlangSignature.canon_atom(m.group('modname'))
+            name    = ErlangSignature.canon_atom(m.group('name'))
+            field   = ErlangSignature.canon_atom(m.group('field'))
+        except ValueError:
+            return None
+        return ('%s:%s' % (modname or env_modname, name), field)
+
+    def _find_field(self, env_modname, target):
+        parsed = self._parse_field_target(env_modname, target)
+        if parsed is None:
+            return None
+        (objname, field) = parsed
+        found = self.data['fields'].get(objname, (None, {}))[1].get(field)
+        if found is None:
+            return None
+        docname, refname, default, typ = found
+        title = '#%s.%s' % (objname.split(':', 1)[1], field)
+        if typ is not None:
+            title += ' :: %s' % (typ,)
+        return title, docname, refname
+
+    def _find_obj(self, env, env_modname, name, typ, searchorder=0, version=None):
         """
         Find an object for "name", perhaps using the given module name.
         """
 
         nsname  = ErlangObject.namespace_of_role(typ)
+        if '*' in name:
+            # the first match of a pattern.
+            for arity, entry in self.find_matches(nsname, env_modname, name):
+                return self._entry_title(entry), entry.docname, entry.refname
+            return None
         try:
             sigdata = ErlangSignature.from_text(name, nsname)
         except ValueError:
@@ -1063,15 +2112,15 @@ class ErlangDomain(Domain):
             modname = sigdata.modname
         objname = '%s:%s' % (modname, sigdata.name)
 
-        oinv = self.data['objects'][nsname]
-        if objname not in oinv:
+        arities = self._arities(nsname, objname, version)
+        if not arities:
             return None
 
-        if sigdata.arity in oinv[objname]:
-            flavors = oinv[objname][sigdata.arity]
+        if sigdata.arity in arities:
+            flavors = arities[sigdata.arity]
         elif sigdata.arity is None:
-            arity   = min(oinv[objname])
-            flavors = oinv[objname][arity]
+            arity   = min(arities, key=_arity_key)
+            flavors = arities[arity]
         else:
             return None
 
@@ -1080,6 +2129,10 @@ class ErlangDomain(Domain):
         else:
             entry = flavors[sigdata.flavor]
 
+        docname = self.version_docname(entry.docname, version)
+        return self._entry_title(entry), docname, entry.refname
+
+    def _entry_title(self, entry):
         if entry.objtype == 'callback':
             title = '%s (%s)' % (entry.dispname, l_('callback function'))
         elif entry.objtype == 'function':
@@ -1095,14 +2148,26 @@ class ErlangDomain(Domain):
         else:
             raise ValueError
 
-        return title, entry.docname, entry.refname
+        return title
+
+    def _resolve_target(self, typ, env_modname, target, searchorder=0, version=None):
+        # :: (title, docname, refname) or None
+        (target, explicit) = _split_version(self.env.config, target)
+        version = explicit or version
+        if not self.is_delta_version(version):
+            version = None
 
-    def resolve_xref(self, env, fromdocname, builder,
-                     typ, target, node, contnode):
         if typ == 'mod':
-            if target not in self.data['modules']:
+            minv = self.data['modules']
+            if version is not None:
+                if target in self.data['versions'].get(version, {}).get('modules', {}):
+                    minv = self.data['versions'][version]['modules']
+                elif target in minv and self.version_of(minv[target][0]) is not None:
+                    # the module is not in the version.
+                    return None
+            if target not in minv:
                 return None
-            docname, synopsis, platform, deprecated = self.data['modules'][target]
+            docname, synopsis, platform, deprecated = minv[target]
             title = target
             if synopsis:
                 title += ': ' + synopsis
@@ -1110,36 +2175,137 @@ class ErlangDomain(Domain):
                 title += _(' (deprecated)')
             if platform:
                 title += ' (' + platform + ')'
-            refname = 'module-' + target
+            return title, docname, 'module-' + target
+        elif typ == 'field':
+            return self._find_field(env_modname, target)
+        else:
+            return self._find_obj(self.env, env_modname, target, typ, searchorder,
+                                  version)
+
+    def resolve_xref(self, env, fromdocname, builder,
+                     typ, target, node, contnode):
+        if node.get('erl:unresolved'):
+            # already looked up by ErlangReferencesResolver.
+            return None
+        found = self._resolve_target(*self._reference_key(node))
+        if found is None:
+            return None
+        else:
+            title, docname, refname = found
             return make_refnode(builder, fromdocname, docname, refname,
                                 contnode, title)
-        else:
-            env_modname = node.get('erl:module')
-            searchorder = node.hasattr('refspecific') and 1 or 0
-            found = self._find_obj(env, env_modname, target, typ, searchorder)
-            if found is None:
-                return None
-            else:
+
+    @staticmethod
+    def _reference_key(node):
+        # :: arguments of _resolve_target for a pending_xref.
+        return (node['reftype'],
+                node.get('erl:module'),
+                node['reftarget'],
+                node.hasattr('refspecific') and 1 or 0,
+                node.get('erl:version'))
+
+    def note_references(self, docname, doctree):
+        # :: [(source refname or None, typ, env_modname, target)]
+        refs = []
+        for node in doctree.traverse(addnodes.pending_xref):
+            if node.get('refdomain') != 'erl':
+                continue
+            refs.append((node.get('erl:object'), node['reftype'],
+                         node.get('erl:module'), node['reftarget']))
+        if refs:
+            self.data['references'][docname] = refs
+
+    def update_backlinks(self):
+        """
+        Rebuild the backlink index from references of all documents.
+
+        Returns names of documents whose backlinks are changed.
+        """
+        backlinks = {}
+        for fromdocname in sorted(self.data['references']):
+            for (srcref, typ, env_modname, target) in self.data['references'][fromdocname]:
+                found = self._resolve_target(typ, env_modname, target)
+                if found is None:
+                    continue
                 title, docname, refname = found
-                return make_refnode(builder, fromdocname, docname, refname,
-                                    contnode, title)
+                if (fromdocname, _object_id(self.env.config, srcref)) == (docname, refname):
+                    # self reference.
+                    continue
+                links = backlinks.setdefault(docname, {}).setdefault(refname, [])
+                if (fromdocname, srcref) not in links:
+                    links.append((fromdocname, srcref))
+
+        previous = self.data['backlinks']
+        changed  = [d for d in set(backlinks) | set(previous)
+                    if backlinks.get(d) != previous.get(d)]
+        self.data['backlinks'] = backlinks
+        return sorted(changed)
+
+    def docnames_of_modules(self, modnames):
+        """
+        Names of documents which describe the modules or their objects.
+        """
+        modnames = set(modnames)
+        docnames = set(info[0] for (m, info) in self._iter_modules() if m in modnames)
+        for nsname, objname, arity, flavor, entry in self._iter_entries():
+            if entry.sigdata.modname in modnames:
+                docnames.add(entry.docname)
+        return sorted(docnames)
 
     def get_objects(self):
-        for modname, info in _iteritems(self.data['modules']):
+        for modname, info in sorted(self._iter_modules()):
             yield (modname, modname, 'module', info[0], 'module-' + modname, 0)
 
-        for nsname, oinv in _iteritems(self.data['objects']):
-            for objname, arities in _iteritems(oinv):
-                for arity, flavors in _iteritems(arities):
-                    for flavor, entry in _iteritems(flavors):
-                        for objname in entry.intersphinx_names(arity, flavor):
-                            yield entry.to_intersphinx_target(objname)
+        sharded = self.env.config.erl_search_shards
+        for target in self._get_object_targets():
+            if sharded and target[5] >= 0:
+                # searched through the per-application shards instead.
+                target = target[:5] + (-1,)
+            yield target
+
+    def _get_object_targets(self):
+        # search priorities of yielded names:
+        #   1: 'mod:name', once per object name.
+        #   2: 'mod:name/arity', once per arity.
+        #  -1: other variations. only for inventories, not for search.
+        current = None
+        for nsname, objname, arity, flavor, entry in self._iter_entries():
+            if (nsname, objname) != current:
+                # names never collide between object names.
+                current = (nsname, objname)
+                seen    = set()
+            # flavor None comes first, it is the default target.
+            names = [
+                (entry.canonical_name(None),  1),
+                (entry.canonical_name(arity), 2),
+            ]
+            for invname in entry.intersphinx_names(arity, flavor):
+                names.append((invname, -1))
+            for invname, priority in names:
+                if (entry.objtype, invname) in seen:
+                    continue
+                seen.add((entry.objtype, invname))
+                yield entry.to_intersphinx_target(invname, priority)
+
+        for objname in sorted(self.data['fields']):
+            (modname, name) = objname.split(':', 1)
+            fields = self.data['fields'][objname][1]
+            for field in sorted(fields):
+                (docname, refname, default, typ) = fields[field]
+                fullname = '%s:#%s.%s' % (modname, name, field)
+                yield (fullname, fullname, 'field', docname, refname, -1)
 
     # since sphinx 1.6.
     def get_full_qualified_name(self, node):
         # type: (nodes.Node) -> unicode
 
-        sig_text = node['reftarget']
+        sig_text = _split_version(self.env.config, node['reftarget'])[0]
+        if node['reftype'] == 'field':
+            parsed = self._parse_field_target(node.get('erl:module'), sig_text)
+            if parsed is None:
+                return None
+            (modname, name) = parsed[0].split(':', 1)
+            return '%s:#%s.%s' % (modname, name, parsed[1])
         nsname   = ErlangObject.namespace_of_role(node['reftype'])
         try:
             sig_data = ErlangSignature.from_text(sig_text, nsname)
@@ -1148,5 +2314,1403 @@ class ErlangDomain(Domain):
         return sig_data.to_full_qualified_name()
 
 
+# {{{ batch resolution.
+def _references_resolver():
+    # the transform class, for sphinx 1.6 or later.
+    from sphinx.transforms import SphinxTransform
+
+    class ErlangReferencesResolver(SphinxTransform):
+        """
+        Resolve Erlang references of a document in a batch.
+
+        References of the same role, module context and target are looked
+        up once.  Unresolved ones are left to ReferencesResolver, for the
+        missing-reference event and warnings.
+        """
+
+        # before ReferencesResolver.
+        default_priority = 9
+
+        def apply(self):
+            domain  = self.env.get_domain('erl')
+            builder = self.app.builder
+            found   = {}
+            for node in list(self.document.traverse(addnodes.pending_xref)):
+                if node.get('refdomain') != 'erl':
+                    continue
+                key = domain._reference_key(node)
+                if key not in found:
+                    found[key] = domain._resolve_target(*key)
+                if found[key] is None:
+                    node['erl:unresolved'] = True
+                    continue
+                title, todocname, refname = found[key]
+                fromdocname = node.get('refdoc', self.env.docname)
+                node.replace_self(make_refnode(builder, fromdocname, todocname,
+                                               refname, node[0].deepcopy(), title))
+
+    return ErlangReferencesResolver
+# }}} batch resolution.
+
+
+# {{{ search shards.
+ERLANG_SEARCH_JS = r"""/*
+ * erlang-search.js
+ * ~~~~~~~~~~~~~~~~
+ *
+ * Loads the per-application shards of the Erlang domain search index
+ * on demand.  Generated by sphinxcontrib.erlangdomain.
+ */
+var ErlangSearch = {
+  _base: (document.currentScript ?
+          document.currentScript.src.replace(/[^\/]*$/, '') : ''),
+  _index: null,
+  _shards: {},
+  _waiting: {},
+
+  _load: function(name, file, callback) {
+    if (name in this._shards || (name === null && this._index)) {
+      callback();
+      return;
+    }
+    var key = name === null ? '' : name;
+    if (key in this._waiting) {
+      this._waiting[key].push(callback);
+      return;
+    }
+    this._waiting[key] = [callback];
+    var script = document.createElement('script');
+    script.src = this._base + file;
+    document.head.appendChild(script);
+  },
+
+  _done: function(key) {
+    var callbacks = this._waiting[key] || [];
+    delete this._waiting[key];
+    for (var i = 0; i < callbacks.length; i++)
+      callbacks[i]();
+  },
+
+  setIndex: function(index) {
+    this._index = index;
+    this._done('');
+  },
+
+  addShard: function(name, entries) {
+    this._shards[name] = entries;
+    this._done(name);
+  },
+
+  // callback receives [name, objtype, uri, priority] entries.
+  query: function(term, callback) {
+    var self = this;
+    term = term.toLowerCase();
+    this._load(null, 'index.js', function() {
+      // module names are lowercased in the index as the term is.
+      var colon = term.indexOf(':');
+      var names = [];
+      if (colon > 0 && term.slice(0, colon) in self._index.modules)
+        names = self._index.modules[term.slice(0, colon)].slice();
+      else
+        for (var name in self._index.shards)
+          names.push(name);
+      var pending = names.length;
+      var results = [];
+      var collect = function(name) {
+        var entries = self._shards[name];
+        for (var i = 0; i < entries.length; i++)
+          if (entries[i][0].toLowerCase().indexOf(term) > -1)
+            results.push(entries[i]);
+        if (--pending === 0) {
+          results.sort(function(a, b) {
+            return a[3] - b[3] || (a[0] < b[0] ? -1 : a[0] > b[0] ? 1 : 0);
+          });
+          callback(results);
+        }
+      };
+      if (pending === 0)
+        callback(results);
+      names.forEach(function(name) {
+        self._load(name, self._index.shards[name], function() {
+          collect(name);
+        });
+      });
+    });
+  }
+};
+
+document.addEventListener('DOMContentLoaded', function() {
+  var out = document.getElementById('search-results');
+  var match = /[?&]q=([^&]*)/.exec(window.location.search);
+  if (!out || !match)
+    return;
+  var term = decodeURIComponent(match[1].replace(/\+/g, ' ')).trim();
+  if (!term)
+    return;
+  ErlangSearch.query(term, function(results) {
+    if (!results.length)
+      return;
+    var root = (typeof DOCUMENTATION_OPTIONS !== 'undefined') ?
+               DOCUMENTATION_OPTIONS.URL_ROOT : '';
+    var list = document.createElement('ul');
+    list.className = 'search erlang-search';
+    results.forEach(function(entry) {
+      var item = document.createElement('li');
+      var link = document.createElement('a');
+      link.href = root + entry[2];
+      link.textContent = entry[0];
+      item.appendChild(link);
+      item.appendChild(document.createTextNode(' (Erlang ' + entry[1] + ')'));
+      list.appendChild(item);
+    });
+    out.insertBefore(list, out.firstChild);
+  });
+});
+"""
+
+SEARCH_SHARD_DIR = 'erlang-search'
+DEFAULT_SEARCH_SHARD = '_other'
+
+
+def _write_if_changed(filename, text):
+    # keep mtime of unchanged outputs for incremental deploys.
+    try:
+        with io.open(filename, 'r', encoding='utf-8') as f:
+            if f.read() == text:
+                return False
+    except (IOError, OSError):
+        pass
+    dirname = os.path.dirname(filename)
+    if dirname and not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    with io.open(filename, 'w', encoding='utf-8') as f:
+        f.write(text)
+    return True
+
+def _to_json(obj):
+    return json.dumps(obj, sort_keys=True, separators=(',', ':'))
+
+def _init_search_shards(app):
+    if app.config.erl_search_shards and app.builder.format == 'html':
+        _add_js_file(app, '%s/erlang-search.js' % (SEARCH_SHARD_DIR,))
+
+def _write_search_shards(app, exception):
+    if exception is not None:
+        return
+    if not app.config.erl_search_shards or app.builder.format != 'html':
+        return
+
+    builder  = app.builder
+    domain   = app.env.get_domain('erl')
+    outdir   = os.path.join(builder.outdir, '_static', SEARCH_SHARD_DIR)
+
+    shards = {}
+    for (name, dispname, objtype, docname, refname, priority) in \
+            domain._get_object_targets():
+        if priority < 0:
+            continue
+        modname = name.split(':', 1)[0]
+        shard   = domain.application_of(modname) or DEFAULT_SEARCH_SHARD
+        uri     = builder.get_target_uri(docname) + '#' + refname
+        shards.setdefault(shard, []).append([name, objtype, uri, priority])
+
+    files = {}
+    for shard, entries in _iteritems(shards):
+        entries.sort()
+        files[shard] = '%s.js' % (shard,)
+        _write_if_changed(os.path.join(outdir, files[shard]),
+            'ErlangSearch.addShard(%s, %s);\n' % (_to_json(shard), _to_json(entries)))
+
+    # lowercased module name -> shards, as the script lowercases the term.
+    modules = {}
+    for modname, info in domain._iter_modules():
+        shard = domain.application_of(modname) or DEFAULT_SEARCH_SHARD
+        names = modules.setdefault(modname.lower(), [])
+        if shard in files and shard not in names:
+            names.append(shard)
+    for names in modules.values():
+        names.sort()
+    _write_if_changed(os.path.join(outdir, 'index.js'),
+        'ErlangSearch.setIndex(%s);\n' % (_to_json({'modules': modules, 'shards': files}),))
+    _write_if_changed(os.path.join(outdir, 'erlang-search.js'), ERLANG_SEARCH_JS)
+
+    # shards of applications gone since the last build.
+    written = set(files.values()) | set(['index.js', 'erlang-search.js'])
+    for filename in os.listdir(outdir):
+        if filename.endswith('.js') and filename not in written:
+            os.remove(os.path.join(outdir, filename))
+# }}} search shards.
+
+
+# {{{ module json.
+MODULE_JSON_DIR = 'erlang-modules'
+
+
+def _module_filenames(modnames):
+    # :: modname -> file name.
+    # quoted atoms only contain [-\w.].  names which differ only in case,
+    # 'Foo' and 'foo', get a hash suffix not to share a file on
+    # case-insensitive filesystems.
+    bases = {}
+    for modname in modnames:
+        base = modname.strip("'")
+        bases.setdefault(base.lower(), []).append((modname, base))
+    filenames = {}
+    for names in bases.values():
+        for modname, base in names:
+            if len(names) > 1:
+                digest = hashlib.sha1(modname.encode('utf-8')).hexdigest()[:8]
+                base = '%s-%s' % (base, digest)
+            filenames[modname] = '%s.json' % (base,)
+    return filenames
+
+def _write_module_json(app, exception):
+    if exception is not None:
+        return
+    if not app.config.erl_module_json or app.builder.format != 'html':
+        return
+
+    builder = app.builder
+    domain  = app.env.get_domain('erl')
+    outdir  = os.path.join(builder.outdir, '_static', MODULE_JSON_DIR)
+
+    def uri(docname, refname):
+        return builder.get_target_uri(docname) + '#' + refname
+
+    modules = {}
+    for modname, (docname, synopsis, platform, deprecated) in domain._iter_modules():
+        modules[modname] = {
+            'module'    : modname,
+            'docname'   : docname,
+            'anchor'    : 'module-' + modname,
+            'uri'       : uri(docname, 'module-' + modname),
+            'synopsis'  : synopsis,
+            'deprecated': deprecated,
+            'objects'   : [],
+        }
+
+    for nsname, objname, arity, flavor, entry in domain._iter_entries():
+        modname = entry.sigdata.modname
+        if modname not in modules:
+            # objects of a module without module directive.
+            modules[modname] = {
+                'module' : modname,
+                'objects': [],
+            }
+        modules[modname]['objects'].append({
+            'ns'        : nsname,
+            'objtype'   : entry.objtype,
+            'name'      : entry.sigdata.name,
+            'arity'     : arity,
+            'flavor'    : flavor,
+            'dispname'  : entry.dispname,
+            'deprecated': entry.deprecated,
+            'docname'   : entry.docname,
+            'anchor'    : entry.refname,
+            'uri'       : uri(entry.docname, entry.refname),
+        })
+
+    manifest = _module_filenames(modules)
+    for modname, info in _iteritems(modules):
+        info['objects'].sort(key=lambda o: (
+            o['ns'], o['name'], _arity_key(o['arity']), _flavor_key(o['flavor'])))
+        _write_if_changed(os.path.join(outdir, manifest[modname]), _to_json(info))
+
+    # drop files of removed modules.
+    keep = set(manifest.values())
+    for filename in os.listdir(outdir) if os.path.isdir(outdir) else []:
+        if filename.endswith('.json') and filename not in keep:
+            os.remove(os.path.join(outdir, filename))
+
+    # the manifest is placed beside the directory, any module name is safe.
+    _write_if_changed(outdir + '.json', _to_json(manifest))
+# }}} module json.
+
+
+# {{{ coverage.
+# a comment, or a string, quoted atom or character literal which may
+# contain '%'.
+RE_ERL_COMMENT = re.compile(r'''
+    (?P<quoted> "(?:[^"\\]|\\[\s\S])*" | '(?:[^'\\]|\\[\s\S])*' | [$]\\?[\s\S] )
+    | %.*$
+    ''', re.VERBOSE | re.MULTILINE)
+
+def _strip_erl_comments(text):
+    return RE_ERL_COMMENT.sub(lambda m: m.group('quoted') or '', text)
+
+RE_ERL_ATTRIBUTE = re.compile(r'''
+    ^ \s* - \s* (?P<attr> module|export_type|export|callback) \b \s*
+    ''', re.VERBOSE | re.MULTILINE)
+
+RE_ERL_NAME_ARITY = re.compile(r'''
+    (?P<name> [a-z]\w*|'[-\w.]+') \s* / \s* (?P<arity> \d+)
+    ''', re.VERBOSE)
+
+RE_ERL_ATOM_PREFIX = re.compile(r'''
+    \s* [(]? \s* (?P<name> [a-z]\w*|'[-\w.]+') \s*
+    ''', re.VERBOSE)
+
+
+def read_erl_exports(text):
+    """
+    Read exports from Erlang source text.
+
+    Returns (modname, {'fn': set, 'ty': set, 'cb': set}) of (name, arity),
+    modname is None if the text has no -module attribute.
+    """
+    text    = _strip_erl_comments(text)
+    modname = None
+    exports = {'fn': set(), 'ty': set(), 'cb': set()}
+    for m in RE_ERL_ATTRIBUTE.finditer(text):
+        attr = m.group('attr')
+        rest = text[m.end():]
+        if attr in ('export', 'export_type'):
+            # '([name/arity, ...]).'
+            end = rest.find(']')
+            if end < 0:
+                # not closed, the rest of the file is not a list of exports.
+                continue
+            body = rest[:end]
+            ns   = 'fn' if attr == 'export' else 'ty'
+            for n in RE_ERL_NAME_ARITY.finditer(body):
+                try:
+                    name = ErlangSignature.canon_atom(n.group('name'))
+                except ValueError:
+                    continue
+                exports[ns].add((name, int(n.group('arity'))))
+            continue
+
+        n = RE_ERL_ATOM_PREFIX.match(rest)
+        if not n:
+            continue
+        try:
+            name = ErlangSignature.canon_atom(n.group('name'))
+        except ValueError:
+            continue
+        if attr == 'module':
+            modname = name
+        elif rest[n.end():n.end() + 1] == '(':
+            # '-callback name(Args) -> Result.'
+            counted = _count_args(rest, n.end())
+            if counted is not None:
+                exports['cb'].add((name, counted[0]))
+    return modname, exports
+
+
+def _compact_uint(data, pos):
+    # small values of the compact term format, used by long atom chunks.
+    b = data[pos]
+    if not b & 0x08:
+        return b >> 4, pos + 1
+    if not b & 0x10:
+        return ((b & 0xe0) << 3) | data[pos + 1], pos + 2
+    raise ValueError
+
+def read_beam_exports(data):
+    """
+    Read exported functions from a .beam file, without the runtime.
+
+    Returns (modname, set of (name, arity)).
+    """
+    data = bytearray(data)
+    if data[0:4] != b'FOR1' or data[8:12] != b'BEAM':
+        raise ValueError
+    chunks = {}
+    pos = 12
+    while pos + 8 <= len(data):
+        chunk_id = bytes(data[pos:pos + 4])
+        (size,)  = struct.unpack('>I', bytes(data[pos + 4:pos + 8]))
+        chunks[chunk_id] = data[pos + 8:pos + 8 + size]
+        pos += 8 + ((size + 3) & ~3)
+
+    if b'AtU8' in chunks:
+        atom_data, encoding = chunks[b'AtU8'], 'utf-8'
+    elif b'Atom' in chunks:
+        atom_data, encoding = chunks[b'Atom'], 'latin-1'
+    else:
+        raise ValueError
+    (count,) = struct.unpack('>i', bytes(atom_data[0:4]))
+    atoms = []
+    pos   = 4
+    for n in range(abs(count)):
+        if count < 0:
+            # long atoms since OTP 28.
+            length, pos = _compact_uint(atom_data, pos)
+        else:
+            length, pos = atom_data[pos], pos + 1
+        atoms.append(bytes(atom_data[pos:pos + length]).decode(encoding))
+        pos += length
+
+    exports = set()
+    expt    = chunks.get(b'ExpT', bytearray(4))
+    (count,) = struct.unpack('>I', bytes(expt[0:4]))
+    for i in range(count):
+        (atom, arity, label) = struct.unpack('>III', bytes(expt[4 + i * 12:16 + i * 12]))
+        exports.add((_quote_atom(atoms[atom - 1]), arity))
+    # generated by the compiler.
+    exports.difference_update([('module_info', 0), ('module_info', 1)])
+    return _quote_atom(atoms[0]), exports
+
+def _quote_atom(name):
+    try:
+        return ErlangSignature.canon_atom(name)
+    except ValueError:
+        return ErlangSignature.canon_atom("'%s'" % (name,))
+
+def _application_from_path(path):
+    # '.../<app>[-<vsn>]/{src,ebin,include}/<mod>.{erl,beam}'
+    parent = os.path.dirname(os.path.abspath(path))
+    if os.path.basename(parent) not in ('src', 'ebin', 'include'):
+        return None
+    appdir = os.path.basename(os.path.dirname(parent))
+    return re.sub(r'-[\d.]+\Z', '', appdir) or None
+
+
+def _coverage_builder():
+    # the builder class, sphinx.builders is imported on setup only.
+    from sphinx.builders import Builder
+
+    class ErlangCoverageBuilder(Builder):
+        """
+        Report exported functions, types and callbacks without descriptions.
+        """
+
+        name = 'erlcoverage'
+        epilog = ('Testing of coverage in the sources finished, look at the '
+                  'results in %(outdir)s/erlang.txt.')
+
+        NAMESPACES = [('fn', 'function'), ('ty', 'type'), ('cb', 'callback')]
+
+        def init(self):
+            pass
+
+        def get_outdated_docs(self):
+            return 'coverage overview'
+
+        def write(self, *ignored):
+            exported = self._read_exports()
+            domain   = self.env.get_domain('erl')
+            modules  = dict(domain._iter_modules())
+
+            # set of (nsname, modname, name, arity), in a single pass.
+            documented = set()
+            for nsname, objname, arity, flavor, entry in domain._iter_entries():
+                documented.add((nsname, entry.sigdata.modname, entry.sigdata.name, arity))
+
+            # :: appname -> modname -> {'module': bool, nsname: [(name, arity)]}
+            report  = {}
+            summary = {}
+            for modname in sorted(exported):
+                (appname, objects) = exported[modname]
+                appname = domain.application_of(modname) or appname or ''
+                total = summary.setdefault(appname, [0, 0])
+                undoc = {}
+                for nsname, label in self.NAMESPACES:
+                    missing = sorted(o for o in objects[nsname]
+                                     if (nsname, modname) + o not in documented)
+                    total[0] += len(objects[nsname])
+                    total[1] += len(objects[nsname]) - len(missing)
+                    if missing:
+                        undoc[nsname] = ['%s/%d' % o for o in missing]
+                if modname not in modules:
+                    undoc['module'] = True
+                if undoc:
+                    report.setdefault(appname, {})[modname] = undoc
+
+            self._write_text(report, summary)
+            _write_if_changed(os.path.join(self.outdir, 'erlang.json'),
+                              json.dumps(report, sort_keys=True, indent=1) + '\n')
+
+        def _read_exports(self):
+            # :: modname -> (appname, {nsname: set of (name, arity)})
+            exported = {}
+            for path in self.config.erl_coverage_paths:
+                path = os.path.join(self.app.confdir, path)
+                for dirpath, dirnames, filenames in os.walk(path):
+                    dirnames.sort()
+                    for filename in sorted(filenames):
+                        filename = os.path.join(dirpath, filename)
+                        try:
+                            if filename.endswith('.erl'):
+                                with io.open(filename, 'r', encoding='utf-8',
+                                             errors='replace') as f:
+                                    modname, objects = read_erl_exports(f.read())
+                            elif filename.endswith('.beam'):
+                                with open(filename, 'rb') as f:
+                                    modname, functions = read_beam_exports(f.read())
+                                objects = {'fn': functions, 'ty': set(), 'cb': set()}
+                            else:
+                                continue
+                        except (IOError, OSError, ValueError, IndexError, struct.error):
+                            _warn(self.env, 'cannot read exports from %s', filename,
+                                  location=(None, None))
+                            continue
+                        if modname is None:
+                            continue
+                        appname = _application_from_path(filename)
+                        if modname not in exported:
+                            exported[modname] = (appname, objects)
+                        else:
+                            # e.g. both of .erl and .beam.
+                            for nsname, names in _iteritems(objects):
+                                exported[modname][1][nsname].update(names)
+            return exported
+
+        def _write_text(self, report, summary):
+            lines = ['Undocumented Erlang objects', '=' * 27, '']
+            for appname in sorted(summary):
+                (total, documented) = summary[appname]
+                title = appname or '(no application)'
+                lines.extend([title, '-' * len(title), ''])
+                if total:
+                    lines.append('%d of %d exported objects documented (%.2f%%).'
+                                 % (documented, total, 100.0 * documented / total))
+                    lines.append('')
+                for modname in sorted(report.get(appname, {})):
+                    undoc = report[appname][modname]
+                    if undoc.get('module'):
+                        lines.append('* %s (no module description)' % (modname,))
+                    else:
+                        lines.append('* %s' % (modname,))
+                    for nsname, label in self.NAMESPACES:
+                        for name in undoc.get(nsname, []):
+                            lines.append('   * %-8s  %s' % (label, name))
+                lines.append('')
+            _write_if_changed(os.path.join(self.outdir, 'erlang.txt'), '\n'.join(lines))
+
+        def finish(self):
+            pass
+
+    return ErlangCoverageBuilder
+# }}} coverage.
+
+
+# {{{ backlinks.
+def _collect_references(app, doctree):
+    if app.config.erl_backlinks:
+        app.env.get_domain('erl').note_references(app.env.docname, doctree)
+
+def render_backlinks(app, doctree, docname):
+    placeholders = list(doctree.traverse(erl_backlinks))
+    if not placeholders:
+        return
+
+    env       = app.env
+    backlinks = env.get_domain('erl').data['backlinks'].get(docname, {})
+    for node in placeholders:
+        links = []
+        for refname in node['refnames']:
+            for link in backlinks.get(refname, []):
+                if link not in links:
+                    links.append(link)
+        if not links:
+            node.replace_self([])
+            continue
+
+        para = nodes.paragraph(classes=['erl-backlinks'])
+        para += nodes.emphasis(_('Referenced by:'), _('Referenced by:'))
+        for (n, (fromdocname, srcref)) in enumerate(links):
+            para += nodes.Text(', ' if n else ' ')
+            if srcref is not None:
+                # 'erl.<nsname>.<fullname>'
+                label = srcref.split('.', 2)[2]
+            elif fromdocname in env.titles:
+                label = env.titles[fromdocname].astext()
+            else:
+                label = fromdocname
+            para += make_refnode(app.builder, docname, fromdocname,
+                                 _object_id(env.config, srcref) or '',
+                                 nodes.Text(label), label)
+        node.replace_self(para)
+# }}} backlinks.
+
+
+# {{{ object lists.
+def render_object_lists(app, doctree, docname):
+    placeholders = list(doctree.traverse(erl_objectlist))
+    if not placeholders:
+        return
+
+    env    = app.env
+    domain = env.get_domain('erl')
+    for node in placeholders:
+        (typ, env_modname, pattern) = node['erl:key']
+        nsname  = ErlangObject.namespace_of_role(typ)
+        matches = list(domain.find_matches(nsname, env_modname, pattern))
+        if not matches:
+            _warn(env, 'no Erlang objects match %s', pattern,
+                  location=(docname, node.line), type='erl', subtype='empty-listing')
+            node.replace_self([])
+            continue
+
+        blist = nodes.bullet_list(classes=['erl-objectlist'])
+        for arity, entry in matches:
+            text     = entry.canonical_name(arity)
+            contnode = nodes.literal(text, text, classes=['xref', 'erl', 'erl-' + typ])
+            para     = nodes.paragraph()
+            para += make_refnode(app.builder, docname, entry.docname, entry.refname,
+                                 contnode, domain._entry_title(entry))
+            blist += nodes.list_item('', para)
+        node.replace_self(blist)
+# }}} object lists.
+
+
+# {{{ bulk registration.
+def _bulk_signature(objtype, argument, options, modname):
+    sigdata = ErlangSignature.from_text(argument, ErlangObject.namespace_of(objtype))
+    sigdata.decltype = objtype
+    if sigdata.modname is None:
+        sigdata.modname = options.get('module', modname)
+    if 'flavor' in options:
+        flavor = ErlangSignature.canon_atom(options['flavor'])
+        if sigdata.flavor is None:
+            sigdata.flavor = flavor
+        elif sigdata.flavor != flavor:
+            raise ValueError
+    return sigdata
+
+
+class ErlangBulkObjects(Transform):
+    """
+    Register the records of ErlangDomain.add_objects for the document.
+
+    Targets of objects whose ids are not in the document yet, and index
+    entries, are appended to the document.
+    """
+
+    default_priority = 800
+
+    def apply(self):
+        env     = self.document.settings.env
+        domain  = env.get_domain('erl')
+        pending = domain._pending_records().pop(env.docname, None)
+        if not pending:
+            return
+
+        self.erl_env     = env
+        self.erl_domain  = domain
+        self.erl_index   = addnodes.index(entries=[])
+        self.erl_targets = []
+        for records, modname, lineno in pending:
+            if lineno is None:
+                lineno = self._last_line()
+            for (objtype, argument, options) in records:
+                if objtype == 'module':
+                    modname = self._add_module(argument, options, lineno) or modname
+                else:
+                    self._add_object(objtype, argument, options, modname, lineno)
+
+        self.document += self.erl_index
+        self.document.extend(self.erl_targets)
+
+    def _last_line(self):
+        # records without lineno are reported where their targets go.
+        lines = [node.line for node in self.document.traverse()
+                 if getattr(node, 'line', None)]
+        return max(lines) if lines else None
+
+    def _add_target(self, ids):
+        if ids[0] in self.document.ids:
+            # emitted by the generator.
+            return
+        target = nodes.target('', '', ids=[i for i in ids if i not in self.document.ids])
+        self.document.note_explicit_target(target)
+        self.erl_targets.append(target)
+
+    def _add_module(self, argument, options, lineno):
+        env      = self.erl_env
+        location = (env.docname, lineno)
+        try:
+            modname = ErlangSignature.canon_atom(argument.strip())
+        except ValueError:
+            _diagnose(env, 'invalid-module-name',
+                'invalid Erlang module name: %s',
+                argument,
+                location=location)
+            return None
+
+        self._add_target(['module-' + modname])
+        self.erl_index['entries'].extend(_module_index_entries(env, modname))
+        self.erl_domain.add_module(
+            modname, env.docname, lineno,
+            options.get('synopsis', ''),
+            options.get('platform', ''),
+            'deprecated' in options,
+            _module_application(env, options, location),
+            _module_behaviours(env, options, location))
+        return modname
+
+    def _add_object(self, objtype, argument, options, modname, lineno):
+        env = self.erl_env
+        try:
+            sigdata = _bulk_signature(objtype, argument, options, modname)
+        except ValueError:
+            _diagnose(env, 'invalid-signature',
+                'invalid signature for Erlang %s description: %s',
+                objtype,
+                argument,
+                location=(env.docname, lineno))
+            return
+
+        fullname = sigdata.to_full_name()
+        refnames = _object_ids(env.config, sigdata.nsname, fullname)
+        self._add_target(refnames)
+        self.erl_index['entries'].extend(
+            _object_index_entries(env, sigdata, refnames[0], fullname))
+
+        domain = self.erl_domain
+        registered = domain.add_object(sigdata, refnames[0], env.docname, lineno,
+                                       'deprecated' in options)
+        if registered and sigdata.nsname == 'rec' and \
+                not domain.is_delta_version(domain.version_of(env.docname)):
+            fields = [(name, default, typ, None)
+                      for (name, default, typ, text) in sigdata.rec_fields or []]
+            _add_record_fields(env, self.document, '%s:%s' % (sigdata.modname, sigdata.name),
+                               fields, lambda refname, node: self._add_target([refname]),
+                               lineno)
+# }}} bulk registration.
+
+
+# {{{ module pages.
+SPLIT_MARKER = '.. generated by sphinxcontrib.erlangdomain from %s, do not edit.'
+# in the doctree directory, source paths of the generated pages.
+SPLIT_PAGES_FILE = 'erlang-split-pages.json'
+
+
+def _split_title_start(lines, index):
+    # a section title right above the directive, and targets right above
+    # the title or the directive, go with the module.
+    j = index
+    while j > 0 and not lines[j - 1].strip():
+        j -= 1
+    if j >= 2 and RE_SECTION_ADORNMENT.match(lines[j - 1]) \
+            and lines[j - 2].strip() \
+            and not RE_SECTION_ADORNMENT.match(lines[j - 2]):
+        j -= 2
+        if j >= 1 and RE_SECTION_ADORNMENT.match(lines[j - 1]):
+            # overline.
+            j -= 1
+    else:
+        j = index
+    while j > 0:
+        k = j
+        while k > 0 and not lines[k - 1].strip():
+            k -= 1
+        if k > 0 and lines[k - 1].startswith('.. _'):
+            j = k - 1
+        else:
+            break
+    return j
+
+def _has_title(lines):
+    for (line, next_line) in zip(lines, lines[1:]):
+        if line.strip() and not line[0].isspace() \
+                and not RE_SECTION_ADORNMENT.match(line) \
+                and RE_SECTION_ADORNMENT.match(next_line) \
+                and len(next_line.rstrip()) >= len(line.rstrip()):
+            return True
+    return False
+
+def split_module_source(text):
+    """
+    Split source text at top level module directives.
+
+    Returns the preamble, and a list of (modname, text) in the order of
+    appearance.  Contents of a same module are joined.
+    """
+    lines  = text.splitlines()
+    starts = []
+    for (i, line) in enumerate(lines):
+        m = RE_MODULE_DIRECTIVE.match(line)
+        if m:
+            starts.append((_split_title_start(lines, i), m.group('modname')))
+
+    if not starts:
+        return text, []
+
+    preamble = '\n'.join(lines[:starts[0][0]]).rstrip() + '\n'
+    pieces   = []
+    texts    = {}
+    for (n, (start, modname)) in enumerate(starts):
+        if n + 1 < len(starts):
+            end = starts[n + 1][0]
+        else:
+            end = len(lines)
+        piece = lines[start:end]
+        if modname not in texts:
+            if not _has_title(piece):
+                title = modname.strip("'")
+                piece = [title, '=' * len(title), ''] + piece
+            pieces.append(modname)
+            texts[modname] = []
+        texts[modname].extend(piece)
+
+    return preamble, [(m, '\n'.join(texts[m]).rstrip() + '\n') for m in pieces]
+
+def _module_page_name(docname, modname):
+    return '%s.%s' % (docname, modname.strip("'"))
+
+def _generate_module_pages(app):
+    env      = app.env
+    excluded = compile_matchers(app.config.exclude_patterns)
+    pages    = set()
+    for docname in app.config.erl_split_documents:
+        if any(match(env.doc2path(docname, None).replace(os.sep, '/'))
+               for match in excluded):
+            # not a source, its pages would be.
+            continue
+        filename = env.doc2path(docname)
+        try:
+            with io.open(filename, 'r', encoding=app.config.source_encoding) as f:
+                text = f.read()
+        except (IOError, OSError):
+            _warn(env, 'cannot read %s to split Erlang modules.', filename,
+                location=(docname, None))
+            continue
+
+        preamble, pieces = split_module_source(text)
+        marker  = SPLIT_MARKER % (docname,)
+        written = set()
+        for modname, piece in pieces:
+            pagename = env.doc2path(_module_page_name(docname, modname))
+            _write_if_changed(pagename, marker + '\n\n' + piece)
+            written.add(os.path.abspath(pagename))
+
+        # drop pages of removed modules.
+        dirname = os.path.dirname(filename)
+        prefix  = os.path.basename(os.path.splitext(filename)[0]) + '.'
+        for name in os.listdir(dirname):
+            path = os.path.abspath(os.path.join(dirname, name))
+            if not name.startswith(prefix) or path in written:
+                continue
+            try:
+                with io.open(path, 'r', encoding=app.config.source_encoding) as f:
+                    first_line = f.readline().rstrip()
+            except (IOError, OSError, UnicodeError):
+                continue
+            if first_line == marker:
+                os.remove(path)
+        pages.update(written)
+
+    _remove_stale_pages(app, pages)
+
+def _remove_stale_pages(app, pages):
+    # pages of documents which are not split any more, by the manifest
+    # of the previous build.
+    manifest = os.path.join(app.doctreedir, SPLIT_PAGES_FILE)
+    try:
+        with io.open(manifest, 'r', encoding='utf-8') as f:
+            previous = json.load(f)
+    except (IOError, OSError, ValueError):
+        previous = []
+    current = sorted(os.path.relpath(path, app.srcdir) for path in pages)
+    for relpath in previous:
+        path = os.path.join(app.srcdir, relpath)
+        if relpath in current or not os.path.isfile(path):
+            continue
+        try:
+            with io.open(path, 'r', encoding=app.config.source_encoding) as f:
+                first_line = f.readline()
+        except (IOError, OSError, UnicodeError):
+            continue
+        if first_line.startswith(SPLIT_MARKER.split('%s')[0]):
+            os.remove(path)
+    if current or previous:
+        _write_if_changed(manifest, _to_json(current) + '\n')
+
+def _replace_split_source(app, docname, source):
+    if docname not in app.config.erl_split_documents:
+        return
+    preamble, pieces = split_module_source(source[0])
+    if not pieces:
+        return
+    toctree = ['', '.. toctree::', '   :maxdepth: 1', '']
+    for modname, piece in pieces:
+        toctree.append('   /%s' % (_module_page_name(docname, modname),))
+    source[0] = preamble + '\n'.join(toctree) + '\n'
+# }}} module pages.
+
+
+# {{{ reproducible outputs.
+def _sort_index_entries(app, env):
+    # genindex lists links of an entry in iteration order of documents,
+    # which depends on read order.  keep it sorted by docname.
+    if hasattr(env, 'indexentries'):
+        # until sphinx 2.0.
+        entries = env.indexentries
+    else:
+        entries = env.get_domain('index').data['entries']
+    items = sorted(_iteritems(entries))
+    entries.clear()
+    entries.update(items)
+
+def _write_output_manifest(app, exception):
+    if exception is not None or not app.config.erl_output_manifest:
+        return
+
+    outdir   = app.builder.outdir
+    manifest = os.path.join(outdir, app.config.erl_output_manifest)
+    digests  = {}
+    for dirpath, dirnames, filenames in os.walk(outdir):
+        # skip hidden entries, e.g. .doctrees and .buildinfo.
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith('.'))
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            if filename.startswith('.') or path == manifest:
+                continue
+            digest = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(65536), b''):
+                    digest.update(chunk)
+            relpath = os.path.relpath(path, outdir).replace(os.sep, '/')
+            digests[relpath] = digest.hexdigest()
+
+    _write_if_changed(manifest,
+        json.dumps(digests, sort_keys=True, indent=0, separators=(',', ':')) + '\n')
+# }}} reproducible outputs.
+
+
+# {{{ api snapshot.
+def _write_api_snapshot(app, exception):
+    if exception is not None or not app.config.erl_api_snapshot:
+        return
+    # does not import Sphinx, imported here to keep it out of every build.
+    from sphinxcontrib import erlangtool
+
+    domain  = app.env.get_domain('erl')
+    records = []
+    for modname, (docname, synopsis, platform, deprecated) in domain._iter_modules():
+        records.append(['module', modname, '', -1, '', None,
+                        bool(deprecated), modname])
+
+    seen = set()
+    for nsname, objname, arity, flavor, entry in domain._iter_entries():
+        if entry.twin:
+            # the flavored object has its record.
+            continue
+        sigdata = entry.sigdata
+        # one record for an arity range, not for each arity.
+        key = (nsname, sigdata.modname, sigdata.name, sigdata.arity, flavor)
+        if key in seen:
+            continue
+        seen.add(key)
+        signature = sigdata.to_disp_name()
+        if sigdata.when_text is not None:
+            signature += ' when %s' % (sigdata.when_text,)
+        records.append([
+            nsname,
+            sigdata.modname,
+            sigdata.name,
+            -1 if sigdata.arity is None else sigdata.arity,
+            flavor or '',
+            sigdata.arity_max,
+            bool(entry.deprecated),
+            signature,
+        ])
+
+    header = {'project': app.config.project, 'release': app.config.release}
+    _write_if_changed(
+        os.path.join(app.builder.outdir, app.config.erl_api_snapshot),
+        erlangtool.format_snapshot(records, header))
+# }}} api snapshot.
+
+
+# {{{ symbol index.
+def _write_symbol_index(app, exception):
+    if exception is not None or not app.config.erl_symbol_index:
+        return
+    # does not import Sphinx, imported here to keep it out of every build.
+    from sphinxcontrib import erlangtool
+
+    domain  = app.env.get_domain('erl')
+    records = []
+    for modname, (docname, synopsis, platform, deprecated) in domain._iter_modules():
+        records.append((erlangtool.symbol_key('mod', modname, ''),
+                        '%s#module-%s' % (docname, modname), modname))
+    for nsname, objname, arity, flavor, entry in domain._iter_entries():
+        key = erlangtool.symbol_key(nsname, entry.sigdata.modname,
+                                    entry.sigdata.name, arity, flavor)
+        records.append((key, '%s#%s' % (entry.docname, entry.refname),
+                        entry.dispname))
+
+    filename = os.path.join(app.builder.outdir, app.config.erl_symbol_index)
+    data = erlangtool.format_symbol_index(records)
+    try:
+        with open(filename, 'rb') as f:
+            if f.read() == data:
+                return
+    except (IOError, OSError):
+        pass
+    with open(filename, 'wb') as f:
+        f.write(data)
+# }}} symbol index.
+
+
+# {{{ object ids.
+ERLANG_IDS_JS = r"""/*
+ * erlang-ids.js
+ * ~~~~~~~~~~~~~
+ *
+ * Follows a link to the long id of an Erlang object, when ids are short
+ * hashes by erl_short_ids.  Generated by sphinxcontrib.erlangdomain.
+ */
+(function() {
+  var base = (document.currentScript ?
+              document.currentScript.src.replace(/[^\/]*$/, '') : '');
+  var aliases = null;
+
+  function follow() {
+    var id = decodeURIComponent(location.hash.substring(1));
+    if (id.indexOf('erl.') !== 0 || document.getElementById(id))
+      return;
+    if (aliases !== null) {
+      if (aliases[id])
+        location.replace('#' + aliases[id]);
+      return;
+    }
+    var request = new XMLHttpRequest();
+    request.open('GET', base + 'erlang-ids.json');
+    request.onload = function() {
+      aliases = JSON.parse(request.responseText);
+      follow();
+    };
+    request.send();
+  }
+
+  window.addEventListener('hashchange', follow);
+  if (document.readyState === 'loading')
+    document.addEventListener('DOMContentLoaded', follow);
+  else
+    follow();
+})();
+"""
+
+def _object_id(config, refname):
+    # 'erl.<nsname>.<fullname>' -> id in documents.
+    if refname is None or not config.erl_short_ids:
+        return refname
+    return 'erl-' + hashlib.sha1(refname.encode('utf-8')).hexdigest()[:16]
+
+def _check_object_id(env, refname, name, location):
+    # two names with one short id in a document: the later loses its target.
+    if not env.config.erl_short_ids:
+        return
+    seen  = env.temp_data.setdefault('erl:short_ids', {})
+    other = seen.setdefault(refname, name)
+    if other != name:
+        _diagnose(env, 'id-collision',
+            'short id %s of %s is also the id of %s, set erl_short_ids = False.',
+            refname, name, other,
+            location=location, key=refname)
+
+def _object_ids(config, nsname, fullname):
+    """
+    Ids of an object, the first one is its refname.
+
+    The second one, without flavor, is the refname of the flavor-less twin
+    of a flavored object.  With erl_short_ids, the twin shares the id of the
+    flavored object instead, see ErlangDomain.add_object.
+    """
+    refname = 'erl.%s.%s' % (nsname, fullname)
+    if config.erl_short_ids:
+        return [_object_id(config, refname)]
+    refname_2 = ErlangSignature.drop_flavor_from_full_name(refname)
+    if refname_2 != refname:
+        return [refname, refname_2]
+    return [refname]
+
+def _init_short_ids(app):
+    if app.config.erl_short_ids and app.builder.format == 'html':
+        _add_js_file(app, 'erlang-ids.js')
+
+def _write_id_aliases(app, exception):
+    if exception is not None:
+        return
+    if not app.config.erl_short_ids or app.builder.format != 'html':
+        return
+
+    # :: long id -> short id, the same in all documents.
+    domain  = app.env.get_domain('erl')
+    aliases = {}
+    tables  = [domain.data['objects']]
+    tables.extend(table['objects'] for table in domain.data['versions'].values())
+    for objects in tables:
+        for key, entry in _iter_table(objects):
+            old = 'erl.%s.%s' % (entry.sigdata.nsname, entry.sigdata.to_full_name())
+            aliases[old] = entry.refname
+    for objname, (docname, fields) in _iteritems(domain.data['fields']):
+        for name, (docname, refname, default, typ) in _iteritems(fields):
+            aliases['erl.field.%s.%s' % (objname, name)] = refname
+
+    outdir = os.path.join(app.builder.outdir, '_static')
+    _write_if_changed(os.path.join(outdir, 'erlang-ids.json'), _to_json(aliases))
+    _write_if_changed(os.path.join(outdir, 'erlang-ids.js'), ERLANG_IDS_JS)
+# }}} object ids.
+
+
+# {{{ memory report.
+def _deep_size(obj, seen):
+    # sys.getsizeof of obj and of all objects reachable through containers
+    # and instance attributes, counting each object once in `seen`.
+    size  = 0
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        elif hasattr(obj, '__dict__'):
+            stack.append(obj.__dict__)
+    return size
+
+def _pickled_size(obj):
+    import pickle
+    return len(pickle.dumps(obj, pickle.HIGHEST_PROTOCOL))
+
+def memory_report(domain):
+    """
+    Sizes and counts of the domain data, as a JSON-able dict.
+
+    Sizes are in bytes.  ``deep_size`` counts an object shared by several
+    entries once, ``pickle_size`` is the size in the pickled environment.
+    """
+    data = domain.data
+    namespaces = {}
+    for nsname, oinv in sorted(_iteritems(data['objects'])):
+        arities = {}
+        flavors = {}
+        entries = twins = 0
+        signatures = []
+        for objname, arity_table in _iteritems(oinv):
+            for arity, flavor_table in _iteritems(arity_table):
+                for flavor, entry in _iteritems(flavor_table):
+                    entries += 1
+                    key = '' if arity is None else str(arity)
+                    arities[key] = arities.get(key, 0) + 1
+                    key = flavor or ''
+                    flavors[key] = flavors.get(key, 0) + 1
+                    if entry.twin:
+                        twins += 1
+                    signatures.append(entry.sigdata)
+        namespaces[nsname] = {
+            'names'         : len(oinv),
+            'entries'       : entries,
+            'flavor_twins'  : twins,
+            'arities'       : arities,
+            'flavors'       : flavors,
+            'deep_size'     : _deep_size(oinv, set()),
+            'pickle_size'   : _pickled_size(oinv),
+            'signature_size': _deep_size(signatures, set()) - sys.getsizeof(signatures),
+        }
+
+    keys = {}
+    for key, value in sorted(_iteritems(data)):
+        keys[key] = {
+            'deep_size'  : _deep_size(value, set()),
+            'pickle_size': _pickled_size(value),
+        }
+    return {
+        'objects': namespaces,
+        'modules': len(data['modules']),
+        'data'   : keys,
+        'total'  : {
+            'deep_size'  : _deep_size(data, set()),
+            'pickle_size': _pickled_size(data),
+        },
+    }
+
+def _write_memory_report(app, env):
+    if not app.config.erl_memory_report:
+        return None
+    report = memory_report(env.get_domain('erl'))
+    filename = os.path.join(app.builder.outdir, app.config.erl_memory_report)
+    _write_if_changed(filename, json.dumps(report, indent=1, sort_keys=True) + '\n')
+    _info(app, 'Erlang domain: %d objects, %d KiB in memory, %d KiB pickled.',
+          sum(ns['entries'] for ns in report['objects'].values()),
+          report['total']['deep_size'] // 1024,
+          report['total']['pickle_size'] // 1024)
+    # no documents to be written again.
+    return None
+# }}} memory report.
+
+
+# {{{ watch.
+def _source_suffixes(config):
+    # str before Sphinx 1.3, list, then OrderedDict from 1.8.
+    if isinstance(config.source_suffix, (list, tuple, dict)):
+        return tuple(config.source_suffix)
+    return (config.source_suffix,)
+
+
+class ErlangWatcher(object):
+    """
+    Rebuild a project on changes of its sources.
+
+    The application, the environment and the domain stay in memory between
+    builds, so a rebuild reads and writes only the outdated documents.
+    A change of an ``.erl`` file under `erl_paths` makes the documents of
+    its module outdated.
+    """
+
+    def __init__(self, app, erl_paths=()):
+        self.app = app
+        self.erl_paths = [os.path.join(app.confdir, p) for p in erl_paths]
+        self._changed_modules = set()
+        self._mtimes = self._scan()
+        app.connect('env-get-outdated', self._get_outdated)
+
+    def _scan(self):
+        # :: path -> mtime
+        skip = set(os.path.abspath(d) for d in (self.app.outdir, self.app.doctreedir))
+        roots = [(self.app.srcdir, _source_suffixes(self.app.config) + ('conf.py',))]
+        roots.extend((path, ('.erl',)) for path in self.erl_paths)
+        mtimes = {}
+        for root, suffixes in roots:
+            for dirpath, dirnames, filenames in os.walk(root):
+                dirnames[:] = [d for d in dirnames if not d.startswith('.') and
+                               os.path.abspath(os.path.join(dirpath, d)) not in skip]
+                for filename in filenames:
+                    if not filename.endswith(suffixes):
+                        continue
+                    filename = os.path.join(dirpath, filename)
+                    try:
+                        mtimes[filename] = os.stat(filename).st_mtime
+                    except OSError:
+                        pass
+        return mtimes
+
+    def poll(self):
+        """
+        Returns paths of files added, changed or removed since the last poll.
+        """
+        mtimes  = self._scan()
+        changed = sorted(path for path in set(mtimes) | set(self._mtimes)
+                         if mtimes.get(path) != self._mtimes.get(path))
+        self._mtimes = mtimes
+        for path in changed:
+            if path.endswith('.erl'):
+                self._changed_modules.add(os.path.basename(path)[:-len('.erl')])
+        return changed
+
+    def _generate_module_pages(self, changed):
+        # pages of erl_split_documents are generated at builder-inited,
+        # which runs once in this process.
+        sources = set(os.path.abspath(self.app.env.doc2path(docname))
+                      for docname in self.app.config.erl_split_documents)
+        if not sources.intersection(os.path.abspath(path) for path in changed):
+            return
+        _generate_module_pages(self.app)
+        # the generated pages are read by this build, not changes to poll.
+        self._mtimes = self._scan()
+
+    def _get_outdated(self, app, env, added, changed, removed):
+        modnames = self._changed_modules
+        self._changed_modules = set()
+        if not modnames:
+            return []
+        # not env, Sphinx 1.8 passes the builder.
+        return app.env.get_domain('erl').docnames_of_modules(modnames)
+
+    def run(self, interval=0.5):
+        """
+        Build, then rebuild on every change until interrupted.
+        """
+        self.app.build()
+        try:
+            while True:
+                time.sleep(interval)
+                changed = self.poll()
+                if not changed:
+                    continue
+                if any(os.path.basename(p) == 'conf.py' for p in changed):
+                    _info(self.app, 'conf.py is changed, restart to apply it.')
+                _info(self.app, '%d files are changed, rebuilding.', len(changed))
+                if hasattr(self.app, '_warncount'):
+                    # count warnings of this build only.
+                    self.app._warncount = 0
+                try:
+                    self._generate_module_pages(changed)
+                    self.app.build()
+                except Exception as e:
+                    # keep watching, the next change may fix it.
+                    _info(self.app, 'build failed: %s', e)
+        except KeyboardInterrupt:
+            pass
+        return self.app.statuscode
+# }}} watch.
+
+
+def _env_updated(app, env):
+    _warn_diagnostics(app, env)
+    domain = env.get_domain('erl')
+    if app.config.erl_versions:
+        domain.compact_versions()
+    domain._clear_caches()
+    # of documents which are not read.
+    domain._pending_records().clear()
+    _sort_index_entries(app, env)
+    # documents to be written again.
+    docnames = set(domain.update_listings())
+    if app.config.erl_backlinks:
+        docnames.update(domain.update_backlinks())
+    return sorted(docnames)
+
+
 def setup(app):
     app.add_domain(ErlangDomain)
+    app.add_transform(ErlangBulkObjects)
+    app.add_builder(_coverage_builder())
+    if _SPHINX_VERSION >= (1, 6):
+        app.add_post_transform(_references_resolver())
+
+    # :: application name -> [modname]
+    app.add_config_value('erl_module_applications', {}, 'env')
+    app.add_config_value('erl_search_shards', False, 'html')
+    app.add_config_value('erl_module_json', False, 'html')
+    app.add_config_value('erl_output_manifest', None, '')
+    app.add_config_value('erl_split_documents', [], 'env')
+    app.add_config_value('erl_signature_type_links', True, 'env')
+    app.add_config_value('erl_backlinks', False, 'env')
+    app.add_config_value('erl_index_grouped', False, 'env')
+    app.add_config_value('erl_coverage_paths', [], '')
+    app.add_config_value('erl_api_snapshot', None, '')
+    # :: [(version, docname prefix)], the base version comes first.
+    app.add_config_value('erl_versions', [], 'env')
+    app.add_config_value('erl_diagnostics_file', None, '')
+    app.add_config_value('erl_symbol_index', None, '')
+    app.add_config_value('erl_warning_limit', None, '')
+    app.add_config_value('erl_short_ids', False, 'env')
+    app.add_config_value('erl_memory_report', None, '')
+
+    app.connect('builder-inited', _init_search_shards)
+    app.connect('builder-inited', _init_short_ids)
+    app.connect('builder-inited', _generate_module_pages)
+    app.connect('source-read', _replace_split_source)
+    if _SPHINX_VERSION >= (1, 3):
+        # otherwise diagnostics are warned while documents are read.
+        app.connect('env-before-read-docs', _defer_diagnostics)
+    app.connect('env-updated', _env_updated)
+    app.connect('env-updated', _write_memory_report)
+    app.connect('doctree-read', _collect_references)
+    app.connect('doctree-resolved', resolve_type_references)
+    app.connect('doctree-resolved', render_backlinks)
+    app.connect('doctree-resolved', render_object_lists)
+    app.connect('build-finished', _write_search_shards)
+    app.connect('build-finished', _write_module_json)
+    app.connect('build-finished', _write_api_snapshot)
+    app.connect('build-finished', _write_symbol_index)
+    app.connect('build-finished', _write_diagnostics)
+    app.connect('build-finished', _write_id_aliases)
+    # must be the last one, to see all other outputs.
+    app.connect('build-finished', _write_output_manifest)
+
+    return {
+        'version': '0.2',
+        'parallel_read_safe': True,
+    }
@@ -0,0 +1,375 @@
+# -*- coding: utf-8 -*-
+"""
+    sphinxcontrib.erlangsignature
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Signatures of Erlang objects.
+
+    This module does not import Sphinx, to be shared by Erlang domain and
+    its command line tools.
+
+    :copyright: Copyright 2007-2010 by SHIBUKAWA Yoshiki
+    :license: BSD, see LICENSE for details.
+"""
+
+import re
+
+
+RE_ATOM = re.compile( r'''
+    ^
+    (?: ([a-z]\w*) | '([-\w.]+)' )
+    \Z
+    ''', re.VERBOSE)
+
+
+RE_NAME = re.compile( r'''
+    ^
+    (?: ([A-Za-z_]\w*) | '([-\w.]+)' )
+    \Z
+    ''', re.VERBOSE)
+
+
+RE_SIGNATURE = re.compile( r'''
+    ^
+    # modname.
+    (?:
+        (?P<modname> [a-z]\w*|'[-\w.]+')
+        \s*
+        :
+        \s*
+    )?
+
+    # sigil and thing name.
+    (?P<sigil>[#?])?
+    (?P<name> [a-zA-Z_]\w*|'[-\w.]+')
+    \s*
+
+    (?:
+        (?:
+            [/] \s* (?P<arity>\d+) (?:[.][.](?P<arity_max>\d+))? \s*
+        |
+            [(] \s* (?P<arg_text>.*?) \s* [)] \s*
+        )
+        (?:
+            [@] \s* (?P<flavor> [a-zA-Z_]\w*|'[-\w.]+') \s*
+        |
+            \[ \s* [@] \s* (?P<implicit_flavor> [a-zA-Z_]\w*|'[-\w.]+') \s* \] \s*
+        )?
+        (?: when \s* (?P<when_text> .+?) \s* )?
+        (?: -> \s* (?P<ret_ann>\S.*?) \s* )?
+    |
+        [{] \s* (?P<rec_decl>\S.*?)? \s* [}] \s*
+    )?
+
+    # drop a terminal period at this time if any.
+    [.]?
+    \Z
+    ''', re.VERBOSE)
+
+RE_PUNCS = re.compile(r'(\[,|[\[\]{}(),])')
+
+def _split_toplevel(text, sep):
+    # split at `sep` out of brackets, strings and quoted atoms.
+    parts = []
+    depth = 0
+    quote = None
+    start = 0
+    i     = 0
+    while i < len(text):
+        c = text[i]
+        if quote is not None:
+            if c == '\\':
+                i += 1
+            elif c == quote:
+                quote = None
+        elif c in '"\'':
+            quote = c
+        elif c in '([{':
+            depth += 1
+        elif c in ')]}':
+            depth -= 1
+        elif depth == 0 and text.startswith(sep, i):
+            parts.append(text[start:i])
+            i += len(sep)
+            start = i
+            continue
+        i += 1
+    parts.append(text[start:])
+    return parts
+
+
+class ErlangSignature:
+    @classmethod
+    def canon_atom(cls, name):
+        return cls.canon_name_(name, RE_ATOM)
+
+    @classmethod
+    def canon_name(cls, name):
+        return cls.canon_name_(name, RE_NAME)
+
+    @staticmethod
+    def canon_name_(name, regexp):
+        m = regexp.match(name)
+        if not m:
+            # invalid.
+            raise ValueError
+        if m.group(1) is not None:
+            # valid short form.
+            return name
+        m = RE_ATOM.match(m.group(2))
+        if m and m.group(1):
+            # can be described in short form.
+            return m.group(1)
+        # valid long form.
+        return name
+
+    def __init__(self, nsname, d):
+        self.nsname    = nsname
+        self.decltype  = None
+        self.modname   = d['modname'  ]  # Optional[str]
+        self.sigil     = d['sigil'    ]  # Optional[str]
+        self.name      = d['name'     ]  # str
+        self.flavor    = d['flavor'   ]  # Optional[str]
+        self.when_text = d['when_text']  # Optional[str]
+        self.arity     = d['arity'    ]  # Optional[int]
+        self.arity_max = d['arity_max']  # Optional[int]
+        self.arg_text  = d['arg_text' ]  # Optional[str]
+        self.ret_ann   = d['ret_ann'  ]  # Optional[str]
+        self.rec_decl  = d['rec_decl' ]  # Optional[str]
+        self.arg_list  = None
+        self.rec_fields = None
+        self.explicit_flavor = None
+
+        if self.modname is not None:
+            self.modname = self.canon_atom(self.modname)
+        if nsname == 'macro':
+            self.name = self.canon_name(self.name)
+        else:
+            self.name = self.canon_atom(self.name)
+
+        self.explicit_flavor = self.flavor is not None
+        if self.flavor is None and d['implicit_flavor'] is not None:
+            self.flavor = d['implicit_flavor']
+        if self.flavor is not None:
+            self.flavor = self.canon_atom(self.flavor)
+
+        # check constraint on sigil.
+        if self.sigil:
+            if (nsname, self.sigil) not in (('macro', '?'), ('rec', '#')):
+                raise ValueError
+
+        # check constraint on arity.
+        if self.arity_max is not None:
+            if self.arity is not None and self.arity >= self.arity_max:
+                raise ValueError
+
+        # check constraint on the body part by nsname.
+        if self.arity is not None:
+            arg_type = 'arity'
+        elif self.arg_text is not None:
+            arg_type = 'arglist'
+        elif self.rec_decl is not None:
+            arg_type = 'record'
+        else:
+            arg_type = 'none'
+
+        ACCEPTABLE_ARG_TYPES = {
+            'cb'   : ['arity', 'arglist', 'none'],
+            'fn'   : ['arity', 'arglist', 'none'],
+            'macro': ['arity', 'arglist', 'none'],
+            'rec'  : ['record', 'none'],
+            'ty'   : ['arity', 'arglist', 'none'],
+        }
+        if arg_type not in ACCEPTABLE_ARG_TYPES[nsname]:
+            if arg_type != 'none':
+                raise ValueError
+
+        if self.rec_decl is not None:
+            self.rec_fields = list(self._split_rec_decl(self.rec_decl))
+
+        # compute arity.
+        if self.arg_text is not None:
+            self.arg_list  = list(self._split_arglist(self.arg_text))
+            self.arity     = len(list(filter(lambda arg: arg[0] == 'mandatory', self.arg_list)))
+            if self.arity == len(self.arg_list):
+                self.arity_max = None
+            else:
+                self.arity_max = len(self.arg_list)
+
+        if self.when_text is not None:
+            if self.nsname not in ('cb', 'fn', 'macro', 'ty'):
+                raise ValueError
+
+        if self.ret_ann is not None:
+            if self.nsname not in ('cb', 'fn', 'macro'):
+                raise ValueError
+
+    @staticmethod
+    def _split_arglist(arglist_str):
+        tmp   = ''
+        stack = []
+        opt   = False
+        for token in RE_PUNCS.split(arglist_str):
+            if not token or token.isspace():
+                pass
+            elif token in ('[', '{', '('):
+                tmp += token
+                stack.append(token)
+            elif token in (']', '}', ')'):
+                if not stack:
+                    raise ValueError
+                if stack.pop() == '[,':
+                    if tmp:
+                        yield ('optional', tmp.strip())
+                        tmp = ''
+                else:
+                    tmp += token
+            elif token == ',' and not stack:
+                yield ('mandatory', tmp.strip())
+                tmp = ''
+            elif token == '[,':
+                if opt:
+                    yield ('optional', tmp.strip())
+                else:
+                    yield ('mandatory', tmp.strip())
+                tmp = ''
+                opt = True
+                stack.append(token)
+            else:
+                tmp += token
+
+        if stack:
+            raise ValueError
+
+        tmp = tmp.strip()
+        if tmp:
+            yield ('mandatory', tmp)
+
+
+    @classmethod
+    def _split_rec_decl(cls, rec_decl):
+        # yields (name, default, type, text) of each field.
+        # name is None if the field can not be parsed.
+        for text in _split_toplevel(rec_decl, ','):
+            text = text.strip()
+            if not text:
+                continue
+            parts   = _split_toplevel(text, '::')
+            typ     = '::'.join(parts[1:]).strip() or None
+            parts   = _split_toplevel(parts[0], '=')
+            default = '='.join(parts[1:]).strip() or None
+            try:
+                name = cls.canon_atom(parts[0].strip())
+            except ValueError:
+                name = None
+            yield (name, default, typ, text)
+
+    @classmethod
+    def from_text(cls, sig_text, nsname): # (str, nsname) -> ErlangSignature
+        m = RE_SIGNATURE.match(sig_text)
+        if not m:
+            raise ValueError
+
+        d = m.groupdict()
+        if d['arity'] is not None:
+            d['arity'] = int(d['arity'])
+        if d['arity_max'] is not None:
+            d['arity_max'] = int(d['arity_max'])
+
+        return cls(nsname, d)
+
+
+    def to_disp_name(self):
+        if self.modname is None:
+            modname = ''
+        else:
+            modname = '%s:' % (self.modname,)
+
+        name = self.local_disp_name_()
+
+        flavor = ''
+        if self.flavor is not None:
+            flavor = '@%s' % (self.flavor,)
+
+        if self.ret_ann is not None:
+            retann = ' -> %s' % (self.ret_ann,)
+        else:
+            retann = ''
+
+        return modname + name + flavor + retann
+
+    def local_disp_name_(self):
+        if self.nsname == 'rec':
+            if self.rec_decl is None:
+                return '#%s{}' % (self.name,)
+            else:
+                return '#%s{ %s }' % (self.name, self.rec_decl)
+        else:
+            if self.nsname == 'macro':
+                sigil = '?'
+            else:
+                sigil = ''
+            if self.arity is None:
+                return '%s%s'        % (sigil, self.name)
+            elif self.arg_text is not None:
+                return '%s%s(%s)'    % (sigil, self.name, self.arg_text)
+            elif self.arity_max is None:
+                return '%s%s/%d'     % (sigil, self.name, self.arity)
+            else:
+                return '%s%s/%d..%d' % (sigil, self.name, self.arity, self.arity_max)
+
+
+    def to_desc_name(self):
+        if self.nsname == 'rec':
+            return '#%s{}' % (self.name,)
+        else:
+            if self.nsname == 'macro':
+                sigil = '?'
+            else:
+                sigil = ''
+            if self.arity is None:
+                return '%s%s'        % (sigil, self.name)
+            elif self.arg_text is not None:
+                return '%s%s'        % (sigil, self.name)
+            elif self.arity_max is None:
+                return '%s%s/%d'     % (sigil, self.name, self.arity)
+            else:
+                return '%s%s/%d..%d' % (sigil, self.name, self.arity, self.arity_max)
+
+    def is_arglist_mandatory(self):
+        return self.nsname in ['cb', 'fn', 'ty']
+
+    def to_full_name(self):
+        return self.to_full_name_('', True)
+
+    def to_full_qualified_name(self):
+        if self.nsname == 'macro':
+            sigil = '?'
+        elif self.nsname == 'rec':
+            sigil = '#'
+        else:
+            # 'cb', 'fn', 'ty'
+            sigil = ''
+        return self.to_full_name_('', False)
+
+    def to_full_name_(self, sigil, creation):
+        if self.arity_max is not None and creation:
+            fullname = '%s:%s%s/%d..%d' % (self.modname, sigil, self.name, self.arity, self.arity_max)
+        elif self.arity is not None:
+            fullname = '%s:%s%s/%d'     % (self.modname, sigil, self.name, self.arity)
+        elif self.is_arglist_mandatory() and creation:
+            # arglist is mandatory. treat as no arguments.
+            fullname = '%s:%s%s/0' % (self.modname, sigil, self.name)
+        else:
+            fullname = '%s:%s%s'   % (self.modname, sigil, self.name)
+
+        if self.flavor is not None:
+            fullname += '@%s' % (self.flavor)
+        return fullname
+
+    def mfa(self):
+        return (self.modname, self.name, self.arity)
+
+    @staticmethod
+    def drop_flavor_from_full_name(fullname):
+        return re.compile(r'@.*\Z').sub('', fullname, 1)
@@ -0,0 +1,436 @@
+# -*- coding: utf-8 -*-
+"""
+    sphinxcontrib.erlangtool
+    ~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Command line tools for outputs of Erlang domain.
+
+    This module does not import Sphinx, to run without a build.
+
+    :copyright: Copyright 2007-2010 by SHIBUKAWA Yoshiki
+    :license: BSD, see LICENSE for details.
+"""
+
+import argparse
+import io
+import json
+import mmap
+import os
+import struct
+import sys
+
+
+# {{{ api snapshot.
+SNAPSHOT_FORMAT  = 'erlang-api-snapshot'
+SNAPSHOT_VERSION = 1
+
+# field positions of a snapshot record.
+# (ns, module, name, arity, flavor) is the sort key, arity is -1 and
+# flavor is '' if there is none, so that records are comparable.
+NS, MODULE, NAME, ARITY, FLAVOR, ARITY_MAX, DEPRECATED, SIGNATURE = range(8)
+
+def snapshot_key(record):
+    return tuple(record[NS:FLAVOR + 1])
+
+def format_snapshot(records, header=None):
+    """
+    Format records as a snapshot, a JSON header line and one JSON line for
+    each record in the order of snapshot_key.
+    """
+    head = {'format': SNAPSHOT_FORMAT, 'version': SNAPSHOT_VERSION}
+    head.update(header or {})
+    lines = [json.dumps(head, sort_keys=True)]
+    for record in sorted(records, key=snapshot_key):
+        lines.append(json.dumps(record, separators=(',', ':')))
+    return '\n'.join(lines) + '\n'
+
+def read_snapshot(f):
+    """
+    Yield records of a snapshot file object, one by one.
+    """
+    try:
+        head = json.loads(f.readline())
+    except ValueError:
+        head = {}
+    if not isinstance(head, dict) or head.get('format') != SNAPSHOT_FORMAT:
+        raise ValueError('not an Erlang API snapshot')
+    if head.get('version') != SNAPSHOT_VERSION:
+        raise ValueError('unsupported snapshot version: %r' % (head.get('version'),))
+    for line in f:
+        if line.strip():
+            yield json.loads(line)
+
+def diff_snapshots(old, new):
+    """
+    Merge two sorted record iterables in one pass.
+
+    Yields (kind, old_record, new_record), kind is one of 'added',
+    'removed', 'changed' and 'deprecated'.
+    """
+    old = iter(old)
+    new = iter(new)
+    o = next(old, None)
+    n = next(new, None)
+    while o is not None or n is not None:
+        if n is None or (o is not None and snapshot_key(o) < snapshot_key(n)):
+            yield ('removed', o, None)
+            o = next(old, None)
+        elif o is None or snapshot_key(n) < snapshot_key(o):
+            yield ('added', None, n)
+            n = next(new, None)
+        else:
+            if o[SIGNATURE] != n[SIGNATURE] or o[ARITY_MAX] != n[ARITY_MAX]:
+                yield ('changed', o, n)
+            if n[DEPRECATED] and not o[DEPRECATED]:
+                yield ('deprecated', o, n)
+            o = next(old, None)
+            n = next(new, None)
+
+DIFF_SECTIONS = [
+    ('added'     , 'Added'),
+    ('removed'   , 'Removed'),
+    ('changed'   , 'Changed'),
+    ('deprecated', 'Newly deprecated'),
+]
+
+def format_diff(changes):
+    groups = dict((kind, []) for kind, title in DIFF_SECTIONS)
+    for kind, o, n in changes:
+        groups[kind].append((o, n))
+
+    lines = []
+    for kind, title in DIFF_SECTIONS:
+        if not groups[kind]:
+            continue
+        lines.extend([title, '-' * len(title), ''])
+        for o, n in groups[kind]:
+            if kind == 'changed':
+                lines.append('* - %s' % (o[SIGNATURE],))
+                lines.append('  + %s' % (n[SIGNATURE],))
+            else:
+                lines.append('* %s' % ((n or o)[SIGNATURE],))
+        lines.append('')
+    return '\n'.join(lines)
+
+def _cmd_diff(args):
+    with io.open(args.old, 'r', encoding='utf-8') as old_file:
+        with io.open(args.new, 'r', encoding='utf-8') as new_file:
+            changes = list(diff_snapshots(read_snapshot(old_file),
+                                          read_snapshot(new_file)))
+    if args.json:
+        out = json.dumps([
+                {'kind': kind, 'old': o, 'new': n} for kind, o, n in changes
+            ], indent=1) + '\n'
+    else:
+        out = format_diff(changes)
+    sys.stdout.write(out)
+    # like diff(1).
+    return 1 if changes else 0
+# }}} api snapshot.
+
+
+# {{{ symbol index.
+# layout, in big endian:
+#
+#   magic (8 bytes) | count (u32) | reserved (u32)
+#   offsets of records (u32 * count), in the order of keys
+#   records: key length (u32) | key | uri length (u32) | uri
+#            | display name length (u32) | display name
+#
+# key is 'ns NUL module NUL name NUL arity NUL flavor' in UTF-8, arity and
+# flavor are empty if there are none.  uri is 'docname#anchor'.
+SYMBOL_INDEX_MAGIC = b'ERLSYM\x00\x02'
+SYMBOL_INDEX_HEADER = struct.Struct('>8sII')
+
+def symbol_key(ns, module, name, arity=None, flavor=None):
+    parts = [ns, module, name,
+             '' if arity is None else str(arity),
+             flavor or '']
+    return '\0'.join(parts).encode('utf-8')
+
+def format_symbol_index(records):
+    """
+    Format records of (key, uri, display name) as a symbol index.
+    """
+    records = sorted((key, uri.encode('utf-8'), disp.encode('utf-8'))
+                     for (key, uri, disp) in records)
+    chunks  = []
+    offsets = []
+    pos = SYMBOL_INDEX_HEADER.size + 4 * len(records)
+    for (key, uri, disp) in records:
+        chunk = b''.join([struct.pack('>I', len(key)), key,
+                          struct.pack('>I', len(uri)), uri,
+                          struct.pack('>I', len(disp)), disp])
+        offsets.append(pos)
+        chunks.append(chunk)
+        pos += len(chunk)
+    return b''.join([SYMBOL_INDEX_HEADER.pack(SYMBOL_INDEX_MAGIC, len(records), 0),
+                     struct.pack('>%dI' % (len(offsets),), *offsets)] + chunks)
+
+
+class SymbolIndex(object):
+    """
+    Reader of a symbol index written by erl_symbol_index.
+
+    The file is memory-mapped, and a lookup reads O(log n) records.
+
+    >>> index = SymbolIndex('_build/html/erlang-symbols.bin')
+    >>> index.lookup('fn', 'lists', 'append', 2)
+    ('lists#erl.fn.lists:append/2', 'lists:append(List1, List2) -> List3')
+    """
+
+    def __init__(self, filename):
+        with open(filename, 'rb') as f:
+            if not SYMBOL_INDEX_HEADER.size <= _file_size(f):
+                raise ValueError('not an Erlang symbol index')
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, self._count, reserved) = SYMBOL_INDEX_HEADER.unpack_from(self._map, 0)
+        if magic != SYMBOL_INDEX_MAGIC:
+            self.close()
+            raise ValueError('not an Erlang symbol index')
+
+    def close(self):
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self._count
+
+    def _field(self, pos):
+        # :: (bytes, next position)
+        (length,) = struct.unpack_from('>I', self._map, pos)
+        return self._map[pos + 4:pos + 4 + length], pos + 4 + length
+
+    def _key(self, i):
+        (pos,) = struct.unpack_from('>I', self._map, SYMBOL_INDEX_HEADER.size + 4 * i)
+        return self._field(pos)[0], pos
+
+    def _record(self, pos):
+        key, pos = self._field(pos)
+        uri, pos = self._field(pos)
+        disp, pos = self._field(pos)
+        return key, uri.decode('utf-8'), disp.decode('utf-8')
+
+    def _bisect(self, key):
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid)[0] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def lookup(self, ns, module, name, arity=None, flavor=None):
+        """
+        Return (uri, display name) of an object, or None.
+        """
+        key = symbol_key(ns, module, name, arity, flavor)
+        i = self._bisect(key)
+        if i < self._count:
+            found, pos = self._key(i)
+            if found == key:
+                return self._record(pos)[1:]
+        return None
+
+    def scan(self, ns, module, name=None):
+        """
+        Yield (ns, module, name, arity, flavor, uri, display name) of objects
+        of a module, or of a name in the module, in the order of keys.
+        """
+        if name is None:
+            prefix = '\0'.join([ns, module, '']).encode('utf-8')
+        else:
+            prefix = '\0'.join([ns, module, name, '']).encode('utf-8')
+        i = self._bisect(prefix)
+        while i < self._count:
+            key, pos = self._key(i)
+            if not key.startswith(prefix):
+                break
+            key, uri, disp = self._record(pos)
+            (ns_, module_, name_, arity, flavor) = key.decode('utf-8').split('\0')
+            yield (ns_, module_, name_, int(arity) if arity else None,
+                   flavor or None, uri, disp)
+            i += 1
+
+def _file_size(f):
+    f.seek(0, 2)
+    size = f.tell()
+    f.seek(0)
+    return size
+# }}} symbol index.
+
+
+# {{{ query.
+SYMBOL_INDEX_NAME = 'erlang-symbols.bin'
+
+# role name -> namespace in the symbol index, as the roles of the domain.
+QUERY_NAMESPACES = {
+    'callback': 'cb',
+    'func'    : 'fn',
+    'macro'   : 'macro',
+    'mod'     : 'mod',
+    'record'  : 'rec',
+    'type'    : 'ty',
+}
+
+def _arity_key(arity):
+    if arity is None:
+        return -1
+    return arity
+
+def query_symbol_index(index, target, typ='func', modname=None, list_all=False):
+    """
+    Find objects for a reference target, as :erl:<typ>:`target` in a
+    document of module `modname` would be resolved.
+
+    Returns a list of (uri, display name), all arities and flavors of the
+    name if `list_all` is true.
+    """
+    # imported here, the parser costs only when a target is parsed.
+    from sphinxcontrib.erlangsignature import ErlangSignature
+
+    # keys are of canonical atoms, 'lists' for "'lists'".
+    def canon_atom(name):
+        try:
+            return ErlangSignature.canon_atom(name.strip())
+        except ValueError:
+            raise ValueError('invalid module name: %r' % (name,))
+
+    nsname = QUERY_NAMESPACES[typ]
+    if nsname == 'mod':
+        found = index.lookup('mod', canon_atom(target), '')
+        return [found] if found else []
+
+    try:
+        sigdata = ErlangSignature.from_text(target, nsname)
+    except ValueError:
+        raise ValueError('invalid target: %r' % (target,))
+    if sigdata.modname is not None:
+        # canonical already.
+        modname = sigdata.modname
+    elif modname is not None:
+        modname = canon_atom(modname)
+    if modname is None:
+        raise ValueError('target without module name needs --module: %r' % (target,))
+
+    objects = [(arity, flavor, uri, disp)
+               for (ns, module, name, arity, flavor, uri, disp)
+               in index.scan(nsname, modname, sigdata.name)]
+    if list_all:
+        return [(uri, disp) for (arity, flavor, uri, disp) in objects]
+
+    arities = set(arity for (arity, flavor, uri, disp) in objects)
+    if not arities:
+        return []
+    if sigdata.arity is None:
+        arity = min(arities, key=_arity_key)
+    else:
+        arity = sigdata.arity
+    found = index.lookup(nsname, modname, sigdata.name, arity, sigdata.flavor)
+    return [found] if found else []
+
+def _cmd_query(args):
+    filename = args.index
+    if filename is None:
+        filename = os.path.join(args.builddir, SYMBOL_INDEX_NAME)
+    with SymbolIndex(filename) as index:
+        found = query_symbol_index(index, args.target, args.type, args.module,
+                                   args.all)
+    for uri, disp in found:
+        sys.stdout.write('%s\t%s\n' % (uri, disp))
+    # like grep(1).
+    return 0 if found else 1
+# }}} query.
+
+
+# {{{ watch.
+def _cmd_watch(args):
+    # Sphinx is imported only by this command.
+    from sphinx.application import Sphinx
+    from sphinxcontrib.erlangdomain import ErlangWatcher
+    try:
+        from sphinx.util.docutils import docutils_namespace
+    except ImportError:
+        docutils_namespace = None
+
+    overrides = {}
+    for define in args.define:
+        if '=' not in define:
+            raise ValueError('-D option argument must be in the form name=value')
+        key, value = define.split('=', 1)
+        overrides[key] = value
+    doctreedir = args.doctreedir or os.path.join(args.outputdir, '.doctrees')
+    confdir = args.confdir or args.sourcedir
+
+    def watch():
+        app = Sphinx(args.sourcedir, confdir, args.outputdir, doctreedir,
+                     args.builder, overrides)
+        erl_paths = args.erl if args.erl is not None else app.config.erl_coverage_paths
+        return ErlangWatcher(app, erl_paths).run(args.interval)
+
+    if docutils_namespace is None:
+        return watch()
+    with docutils_namespace():
+        return watch()
+# }}} watch.
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='sphinx-erlang',
+        description='Tools for outputs of Sphinx Erlang domain.')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    p = commands.add_parser('diff',
+        help='compare two API snapshots (erl_api_snapshot)')
+    p.add_argument('old', help='snapshot of the older build')
+    p.add_argument('new', help='snapshot of the newer build')
+    p.add_argument('--json', action='store_true', help='write changes as JSON')
+    p.set_defaults(func=_cmd_diff)
+
+    p = commands.add_parser('query',
+        help='find objects in a symbol index (erl_symbol_index)')
+    p.add_argument('builddir', help='output directory of the build')
+    p.add_argument('target', help='reference target, as of the roles')
+    p.add_argument('--type', default='func', choices=sorted(QUERY_NAMESPACES),
+                   help='role of the target (default: func)')
+    p.add_argument('--module', help='module name of a target without one')
+    p.add_argument('--all', action='store_true',
+                   help='list all arities and flavors of the name')
+    p.add_argument('--index', help='symbol index file, if it is not %s '
+                   'in builddir' % (SYMBOL_INDEX_NAME,))
+    p.set_defaults(func=_cmd_query)
+
+    p = commands.add_parser('watch',
+        help='rebuild documents on changes, keeping the environment in memory')
+    p.add_argument('sourcedir', help='source directory')
+    p.add_argument('outputdir', help='output directory')
+    p.add_argument('-b', dest='builder', default='html',
+                   help='builder to use (default: html)')
+    p.add_argument('-c', dest='confdir', help='directory of conf.py')
+    p.add_argument('-d', dest='doctreedir',
+                   help='directory of doctrees (default: OUTPUTDIR/.doctrees)')
+    p.add_argument('-D', dest='define', action='append', default=[],
+                   metavar='NAME=VALUE', help='override a configuration value')
+    p.add_argument('--erl', action='append', metavar='PATH',
+                   help='directory of .erl files to watch '
+                   '(default: erl_coverage_paths)')
+    p.add_argument('--interval', type=float, default=0.5,
+                   help='seconds between polls (default: 0.5)')
+    p.set_defaults(func=_cmd_watch)
+
+    args = parser.parse_args(argv)
+    try:
+        return args.func(args)
+    except (IOError, OSError, ValueError) as e:
+        parser.exit(2, '%s: error: %s\n' % (parser.prog, e))
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -208,3 +208,52 @@ man_pages = [
     ('index', 'sphinxcontrib-rubydomain-acceptancetest', u'sphinxcontrib-rubydomain-acceptancetest Documentation',
      [u'SHIBUKAWA Yoshiki'], 1)
 ]
+
+
+# -- Options for the Erlang domain ---------------------------------------------
+
+# test_doc is the base version, v2/test_doc describes version 2.0.
+erl_versions = [('1.0', 'test_'), ('2.0', 'v2/test_')]
+
+# objects other than modules are searched through per-application shards.
+erl_search_shards = True
+
+# _static/erlang-modules/ has a JSON file for each module.
+erl_module_json = True
+
+# digests of all output files, for deploy tools.
+erl_output_manifest = 'erlang-manifest.json'
+
+# modules of test_split are put on their own pages.
+erl_split_documents = ['test_split']
+
+# sources of the erlcoverage builder.
+erl_coverage_paths = ['src']
+
+# an API snapshot for sphinx-erlang diff.
+erl_api_snapshot = 'erlang-api.jsonl'
+
+# diagnostics are written to a file; the duplicate of the diagnostics test
+# case is not shown.
+erl_diagnostics_file = 'erlang-diagnostics.jsonl'
+suppress_warnings = ['erl.duplicate-object']
+
+# a symbol index for editors and sphinx-erlang query.
+erl_symbol_index = 'erlang-symbols.bin'
+
+# sizes of the domain data.
+erl_memory_report = 'erlang-memory.json'
+
+
+def register_bulk_objects(app, env, docnames):
+    # objects of the bulk registration test case in test_doc.
+    if 'test_doc' in docnames:
+        env.get_domain('erl').add_objects('test_doc', [
+            ('module', 'test_bulk', {'synopsis': 'Registered by conf.py.'}),
+            ('function', 'start(Opts :: opts()) -> ok', {}),
+            ('function', 'stop() -> ok', {'flavor': 'now'}),
+            ('type', 'opts()', {}),
+        ])
+
+def setup(app):
+    app.connect('env-before-read-docs', register_bulk_objects)
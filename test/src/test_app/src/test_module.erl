@@ -0,0 +1,19 @@
+-module(test_module).
+
+-export([module_function/1, variable_function/1, variable_function/2]).
+-export([undocumented/0]).
+-export_type([undocumented_type/0]).
+
+-type undocumented_type() :: term().
+
+module_function(Identifier) ->
+    {ok, Identifier}.
+
+variable_function(Name) ->
+    variable_function(Name, []).
+
+variable_function(_Name, _Option) ->
+    ok.
+
+undocumented() ->
+    ok.